@@ -0,0 +1,42 @@
+"""Latency of loading the product catalogue (get_products) as the catalogue grows.
+
+Each MongoDB operation waits a simulated network round-trip, so latency is
+dominated by the number of round-trips: one, whatever the number of products.
+(What grows at large sizes is the in-memory server copying documents in Python.)
+Usage: python bench/bench_catalogue.py [round_trip_ms]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tests import mongo_stub
+
+REPEAT = 20
+
+
+def main():
+    round_trip = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.02
+    shop = mongo_stub.load_shop()
+    print(f"round-trip {round_trip * 1000:.1f} ms")
+    print(f"{'products':>9} {'round-trips':>12} {'ms/load':>8}")
+    for size in (10, 100, 1000):
+        mongo_stub.reset(shop)
+        shop.db.products.insert_many([
+            {'id': i, 'product_name': f'product-{i}', 'price': 1.0, 'product_type': 'text',
+             'status': 'active', 'available_count': i % 3}
+            for i in range(1, size + 1)
+        ])
+        
+        mongo_stub.ROUND_TRIP['seconds'] = round_trip
+        mongo_stub.ROUND_TRIPS.clear()
+        started = time.monotonic()
+        for _ in range(REPEAT):
+            shop.get_products()
+        elapsed = (time.monotonic() - started) / REPEAT
+        mongo_stub.ROUND_TRIP['seconds'] = 0
+        print(f"{size:>9} {sum(mongo_stub.ROUND_TRIPS.values()) / REPEAT:>12.0f} {elapsed * 1000:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
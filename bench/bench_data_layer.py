@@ -0,0 +1,58 @@
+"""Checkout throughput of the data layer as handler threads are added.
+
+Every MongoDB call waits a simulated network round-trip before reaching an
+in-memory server, so the numbers show how much of that latency the data layer
+lets handlers overlap. The in-memory server itself executes one operation at a
+time (and scans in Python), so the curve flattens once it is saturated; against
+a real deployment that ceiling is the server's. Usage:
+python bench/bench_data_layer.py [round_trip_ms]
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tests import mongo_stub
+
+CHECKOUTS_PER_THREAD = 20
+
+
+def checkout(shop, product_id, txid):
+    """The data-layer calls of one purchase: catalogue read, stock check, reservation, transaction."""
+    shop.get_product_by_id(product_id)
+    shop.get_stock_count(product_id)
+    item = shop.reserve_stash_item(product_id, txid)
+    shop.add_transaction(1, 'buyer', product_id, 'p', 0.1, 'LTC', txid, 'pending', item['id'] if item else None)
+
+
+def run(shop, threads):
+    mongo_stub.reset(shop)
+    shop.add_product('p', 1.0, 'text', 0)
+    product_id = shop.db.products.find_one({})['id']
+    shop.add_stash_items(product_id, (f'item-{i}' for i in range(threads * CHECKOUTS_PER_THREAD)))
+    
+    def handler(worker):
+        for i in range(CHECKOUTS_PER_THREAD):
+            checkout(shop, product_id, f'{worker}-{i}')
+    
+    workers = [threading.Thread(target=handler, args=(worker,)) for worker in range(threads)]
+    started = time.monotonic()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return threads * CHECKOUTS_PER_THREAD / (time.monotonic() - started)
+
+
+def main():
+    mongo_stub.ROUND_TRIP['seconds'] = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.02
+    shop = mongo_stub.load_shop()
+    print(f"round-trip {mongo_stub.ROUND_TRIP['seconds'] * 1000:.1f} ms")
+    print(f"{'threads':>8} {'checkouts/s':>12}")
+    for threads in (1, 2, 4, 8, 16):
+        print(f"{threads:>8} {run(shop, threads):>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
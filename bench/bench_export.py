@@ -0,0 +1,60 @@
+"""Memory and speed of the streaming export as the number of rows grows.
+
+Synthetic transaction rows are generated one at a time (as the cursor yields
+them) and written with write_export into a temporary file. tracemalloc's peak
+shows the memory the export itself holds, which should stay flat from 10k to
+1M rows. The cursor side is bounded separately by EXPORT_BATCH_SIZE. Usage:
+python bench/bench_export.py [max_rows]
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tests import mongo_stub
+
+ROW_COUNTS = (10_000, 100_000, 1_000_000)
+
+
+def generate_rows(count):
+    started = datetime(2024, 1, 1)
+    for i in range(count):
+        created_at = started + timedelta(seconds=i)
+        yield {
+            'id': i, 'created_at': created_at, 'verified_at': created_at + timedelta(minutes=5), 'status': 'verified',
+            'user_id': 1000 + i % 5000, 'username': f'user{i % 5000}', 'product_id': i % 20,
+            'product_name': f'Product {i % 20}', 'amount': 0.01 + i % 100 / 1000, 'crypto_type': 'LTC',
+            'txid': f'{i:064x}', 'deposit_address': None
+        }
+
+
+def measure(shop, file_format, count):
+    with tempfile.TemporaryFile() as export_file:
+        tracemalloc.start()
+        started = time.perf_counter()
+        written = shop.write_export(generate_rows(count), file_format, export_file)
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        assert written == count
+        return count / elapsed, peak / 1024, export_file.tell() / (1024 * 1024)
+
+
+def main():
+    max_rows = int(sys.argv[1]) if len(sys.argv) > 1 else ROW_COUNTS[-1]
+    shop = mongo_stub.load_shop()
+    
+    print(f"{'format':>7} {'rows':>10} {'rows/s':>10} {'peak KiB':>9} {'file MiB':>9}")
+    for file_format in shop.EXPORT_FORMATS:
+        for count in ROW_COUNTS:
+            if count > max_rows:
+                continue
+            rate, peak, size = measure(shop, file_format, count)
+            print(f"{file_format:>7} {count:>10} {rate:>10.0f} {peak:>9.0f} {size:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
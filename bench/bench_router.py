@@ -0,0 +1,81 @@
+"""Dispatch cost of one update as more handlers are registered.
+
+Each bot gets N callback prefixes and N conversation steps and then receives a
+callback for its last registered prefix and a message for its last registered
+step. 'predicates' registers every handler with its own telebot filter lambda,
+the way the handlers used to be declared, so telebot tests them one by one.
+'router' registers the same handlers on an UpdateRouter, which installs a
+single filter per update type and finds the handler with dict lookups. Usage:
+python bench/bench_router.py [dispatches]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tests import mongo_stub
+
+HANDLER_COUNTS = (10, 100, 1000)
+USER_ID = 1
+
+
+def make_updates(telebot, last):
+    user = {'id': USER_ID, 'is_bot': False, 'first_name': 'u'}
+    chat = {'id': USER_ID, 'type': 'private'}
+    call = telebot.types.CallbackQuery.de_json({
+        'id': '1', 'from': user, 'chat_instance': 'c', 'data': f'h{last}_42',
+        'message': {'message_id': 1, 'date': 0, 'chat': chat, 'text': 'x'}
+    })
+    message = telebot.types.Message.de_json({'message_id': 2, 'date': 0, 'chat': chat, 'from': user, 'text': 'x'})
+    return call, message
+
+
+def predicate_bot(telebot, shop, count, handled):
+    bot = telebot.TeleBot('1:bench', threaded=False)
+    for i in range(count):
+        bot.register_callback_query_handler(lambda call: handled.append(1),
+                                            func=lambda call, prefix=f'h{i}_': call.data.startswith(prefix))
+        bot.register_message_handler(lambda message: handled.append(1),
+                                     func=lambda message, step=f's{i}': message.from_user.id in shop.user_state
+                                     and shop.user_state[message.from_user.id]['step'] == step)
+    return bot
+
+
+def router_bot(telebot, shop, count, handled):
+    bot = telebot.TeleBot('1:bench', threaded=False)
+    router = shop.UpdateRouter()
+    for i in range(count):
+        router.callback_prefix(f'h{i}_')(lambda call: handled.append(1))
+        router.step(f's{i}')(lambda message: handled.append(1))
+    router.register(bot)
+    return bot
+
+
+def measure(bot, call, message, dispatches, handled):
+    started = time.perf_counter()
+    for _ in range(dispatches):
+        bot.process_new_callback_query([call])
+        bot.process_new_messages([message])
+    elapsed = time.perf_counter() - started
+    assert len(handled) == 2 * dispatches, "every update must reach its handler"
+    return elapsed / (2 * dispatches) * 1e6
+
+
+def main():
+    dispatches = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    shop = mongo_stub.load_shop()
+    import telebot
+    
+    print(f"{'handlers':>9} {'predicates us/update':>21} {'router us/update':>17}")
+    for count in HANDLER_COUNTS:
+        call, message = make_updates(telebot, count - 1)
+        shop.user_state[USER_ID] = {'step': f's{count - 1}'}
+        results = []
+        for build in (predicate_bot, router_bot):
+            handled = []
+            results.append(measure(build(telebot, shop, count, handled), call, message, dispatches, handled))
+        print(f"{count:>9} {results[0]:>21.1f} {results[1]:>17.1f}")
+
+
+if __name__ == '__main__':
+    main()
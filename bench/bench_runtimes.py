@@ -0,0 +1,123 @@
+"""Update throughput of the threaded (bot_mongo) and asyncio (bot_async) runtimes.
+
+Both bots are pointed at a local fake Telegram Bot API that answers every call
+after a fixed latency. A burst of N users pressing the same button arrives at
+once (a 'main_menu' callback: one editMessageText call per update) and the time
+until every update is answered is measured. The threaded runtime works through
+the burst with telebot's worker pool, the asyncio runtime with one coroutine
+per update. The measured path makes no MongoDB calls (Motor needs a real
+server), so the numbers isolate how each runtime overlaps Telegram latency.
+Usage: python bench/bench_runtimes.py [api_latency_ms]
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tests import mongo_stub
+
+BURSTS = (50, 200, 1000)
+API_LATENCY = {'seconds': 0.05}
+
+
+class FakeTelegramAPI(ThreadingHTTPServer):
+    """Answers every Bot API method with a message after API_LATENCY, counting the calls."""
+    
+    daemon_threads = True
+    request_queue_size = 2048 # A burst opens many connections at once
+    
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeTelegramHandler)
+        self.calls = 0
+        self.lock = threading.Lock()
+    
+    @property
+    def api_url(self):
+        return f"http://127.0.0.1:{self.server_port}/bot{{0}}/{{1}}"
+
+
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # Keep-alive, like the real API
+    
+    def _answer(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        time.sleep(API_LATENCY['seconds'])
+        message = {'message_id': 1, 'date': 0, 'chat': {'id': 1, 'type': 'private'}, 'text': ''}
+        body = json.dumps({'ok': True, 'result': message}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.lock:
+            self.server.calls += 1
+    
+    do_GET = do_POST = _answer
+    
+    def log_message(self, *args):
+        pass
+
+
+def make_updates(telebot, count, first_user):
+    """Builds `count` 'main_menu' callback updates from distinct users (distinct chats, so no screen is cached)."""
+    updates = []
+    for user_id in range(first_user, first_user + count):
+        user = {'id': user_id, 'is_bot': False, 'first_name': 'u'}
+        updates.append(telebot.types.Update.de_json({
+            'update_id': user_id,
+            'callback_query': {
+                'id': str(user_id), 'from': user, 'chat_instance': 'c', 'data': 'main_menu',
+                'message': {'message_id': 1, 'date': 0, 'chat': {'id': user_id, 'type': 'private'}, 'text': 'old'}
+            }
+        }))
+    return updates
+
+
+def run_threaded(shop, api, updates):
+    expected = api.calls + len(updates)
+    started = time.monotonic()
+    shop.bot.process_new_updates(updates)
+    while api.calls < expected:
+        time.sleep(0.001)
+    return time.monotonic() - started
+
+
+def run_async(bot_async, updates):
+    async def burst():
+        started = time.monotonic()
+        await bot_async.abot.process_new_updates(updates)
+        elapsed = time.monotonic() - started
+        await bot_async.abot.close_session()
+        return elapsed
+    return asyncio.run(burst())
+
+
+def main():
+    API_LATENCY['seconds'] = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.05
+    shop = mongo_stub.load_shop()
+    import bot_async
+    import telebot
+    
+    api = FakeTelegramAPI()
+    threading.Thread(target=api.serve_forever, daemon=True).start()
+    telebot.apihelper.API_URL = api.api_url
+    telebot.asyncio_helper.API_URL = api.api_url
+    
+    print(f"Telegram API latency {API_LATENCY['seconds'] * 1000:.0f} ms, {len(shop.bot.worker_pool.workers)} threaded workers")
+    print(f"{'burst':>6} {'threaded upd/s':>15} {'asyncio upd/s':>14}")
+    first_user = 1
+    for burst in BURSTS:
+        threaded = run_threaded(shop, api, make_updates(telebot, burst, first_user))
+        first_user += burst
+        asynchronous = run_async(bot_async, make_updates(telebot, burst, first_user))
+        first_user += burst
+        print(f"{burst:>6} {burst / threaded:>15.1f} {burst / asynchronous:>14.1f}")
+    api.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -8,11 +8,13 @@ import requests
 # import sqlite3 # Removed for MongoDB migration
 import time
 import threading
+import hmac
+import queue
 import logging
 from decimal import Decimal, getcontext, InvalidOperation
 import os
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, OperationFailure
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import ConnectionFailure, OperationFailure, PyMongoError
 from flask import Flask, request
 
 # --- Configuration and Setup ---
@@ -44,10 +46,127 @@ user_sessions = {}
 user_state = {} 
 
 # --- MongoDB Database Functions ---
-db_lock = threading.Lock()
+# MongoClient is thread-safe and pooled, so plain reads and single-document
+# writes run without any Python-side lock. Multi-step read-modify-write sequences
+# take a lock scoped to the entity they touch, e.g. ('sequence', collection_name),
+# so unrelated work never waits on each other.
+_entity_locks = {}
+_entity_locks_guard = threading.Lock()
+
+def entity_lock(kind, key):
+    """Returns the re-entrant lock guarding a single entity (kind, key)."""
+    with _entity_locks_guard:
+        lock = _entity_locks.get((kind, key))
+        if lock is None:
+            lock = _entity_locks[(kind, key)] = threading.RLock()
+        return lock
+
 mongo_client = None
 db = None
 
+_transactions_supported = None
+
+def transactions_supported():
+    """Returns True if the deployment runs multi-document transactions (replica sets and sharded clusters, e.g. Atlas)."""
+    global _transactions_supported
+    if _transactions_supported is None:
+        try:
+            hello = mongo_client.admin.command('hello')
+            _transactions_supported = bool(hello.get('setName') or hello.get('msg') == 'isdbgrid')
+        except PyMongoError as e:
+            logging.error(f"MongoDB error in transactions_supported: {e}")
+            return False
+    return _transactions_supported
+
+def run_in_transaction(operation):
+    """Runs operation(session) as one multi-document transaction and returns its result.
+    
+    A standalone server has no transactions, so there operation(None) runs its
+    writes one by one; counters that could drift that way are repaired by the
+    periodic stock reconciliation (see STOCK_RECONCILE_INTERVAL).
+    """
+    if not transactions_supported():
+        return operation(None)
+    with mongo_client.start_session() as session:
+        return session.with_transaction(operation)
+
+# --- Index Manifest ---
+# Every filtered or sorted query in the data layer is backed by one of these
+# indexes. Entries are (collection, keys, options) and are created idempotently
+# by ensure_indexes() at boot.
+INDEX_MANIFEST = [
+    ('wallets', [('crypto_name', 1)], {'unique': True}),
+    ('products', [('id', 1)], {'unique': True}),
+    ('products', [('product_name', 1)], {'unique': True}),
+    ('products', [('status', 1), ('id', 1)], {}),
+    ('product_stash', [('id', 1)], {'unique': True}),
+    ('product_stash', [('product_id', 1), ('is_used', 1), ('added_at', 1), ('id', 1)], {}),
+    ('product_stash', [('is_used', 1), ('product_id', 1)], {}),
+    ('transactions', [('txid', 1)], {'unique': True, 'sparse': True}),
+    ('transactions', [('created_at', -1)], {}),
+    ('transactions', [('status', 1)], {}),
+    ('transactions', [('status', 1), ('created_at', 1)], {}),
+    ('transactions', [('stash_id', 1)], {}),
+    ('users', [('id', 1)], {'unique': True}),
+    ('used_txids', [('txid', 1)], {'unique': True}),
+]
+
+# Representative (collection, filter, sort) shapes of the data-layer queries.
+# verify_query_plans() explains each one to make sure none falls back to COLLSCAN.
+QUERY_SHAPES = [
+    ('wallets', {'crypto_name': 'LTC'}, None),
+    ('products', {'id': 1, 'status': 'active'}, None),
+    ('products', {'id': 1}, None),
+    ('products', {'status': 'active'}, None),
+    ('products', {}, [('id', -1)]),
+    ('product_stash', {'product_id': 1, 'is_used': 0}, [('added_at', 1), ('id', 1)]),
+    ('product_stash', {'id': 1, 'is_used': 0}, None),
+    ('product_stash', {'is_used': 0}, None),
+    ('product_stash', {}, [('id', -1)]),
+    ('transactions', {'txid': 'txid'}, None),
+    ('transactions', {'status': 'pending'}, None),
+    ('transactions', {'status': 'pending', 'created_at': {'$lt': datetime(2000, 1, 1)}}, None),
+    ('transactions', {'stash_id': 1}, None),
+    ('transactions', {}, [('created_at', -1)]),
+    ('users', {'id': 1}, None),
+    ('used_txids', {'txid': 'txid'}, None),
+]
+
+def ensure_indexes(database):
+    """Creates every index in INDEX_MANIFEST (no-op for indexes that already exist)."""
+    for collection, keys, options in INDEX_MANIFEST:
+        try:
+            database[collection].create_index(keys, **options)
+        except OperationFailure as e:
+            logging.warning(f"Could not create index {keys} on {collection}: {e}")
+
+def _plan_stages(plan):
+    """Yields every stage name found in an explain() plan tree."""
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _plan_stages(value)
+
+def verify_query_plans(database):
+    """Explains every QUERY_SHAPES entry and returns the ones whose winning plan is a COLLSCAN."""
+    offenders = []
+    for collection, query, sort in QUERY_SHAPES:
+        try:
+            cursor = database[collection].find(query)
+            if sort:
+                cursor = cursor.sort(sort)
+            plan = cursor.explain().get('queryPlanner', {}).get('winningPlan', {})
+            if 'COLLSCAN' in _plan_stages(plan):
+                logging.warning(f"Query on {collection} {query} (sort={sort}) uses a COLLSCAN. Check INDEX_MANIFEST.")
+                offenders.append((collection, query, sort))
+        except OperationFailure as e:
+            logging.error(f"MongoDB error while explaining query on {collection}: {e}")
+    return offenders
+
 def init_database():
     """Initializes the MongoDB connection and returns the database object."""
     global mongo_client, db
@@ -58,29 +177,11 @@ def init_database():
         db = mongo_client[DB_NAME]
         logging.info("Successfully connected to MongoDB.")
         
-        # Ensure indexes for key fields (equivalent to UNIQUE/PRIMARY KEY in SQL)
-        # Using try/except to avoid conflicts if indexes already exist
-        db.wallets.create_index("crypto_name", unique=True)
-        db.products.create_index("id", unique=True) # Use 'id' as primary key equivalent
-        db.products.create_index("product_name", unique=True)
-        
-        try:
-            db.transactions.create_index("txid", unique=True, sparse=True)
-        except OperationFailure:
-            logging.warning("MongoDB index for transactions already exists or conflict occurred. Skipping index creation.")
-            pass
-        
-        try:
-            db.users.create_index("id", unique=True) # Telegram user ID
-        except OperationFailure:
-            logging.warning("MongoDB index for users already exists or conflict occurred. Skipping index creation.")
-            pass
-        
-        try:
-            db.used_txids.create_index("txid", unique=True)
-        except OperationFailure:
-            logging.warning("MongoDB index for used_txids already exists or conflict occurred. Skipping index creation.")
-            pass
+        # Ensure indexes for every data-layer query and verify they are used
+        ensure_indexes(db)
+        offenders = verify_query_plans(db)
+        if offenders and os.environ.get('STRICT_INDEX_CHECK') == '1':
+            raise RuntimeError(f"{len(offenders)} data-layer queries fall back to COLLSCAN: {offenders}")
         
         return db
     except ConnectionFailure as e:
@@ -97,394 +198,596 @@ def init_database():
 # Initialize the database connection globally
 # db = init_database() # Will be called in __main__
 
+# --- ID Allocation ---
+# MongoDB has no auto-increment, so integer ids come from the `counters`
+# collection: one atomic $inc reserves a whole block of ids for this process,
+# and later ids are served from memory. Ids are unique across processes but may
+# have gaps (e.g. the unused rest of a block after a restart).
+ID_BLOCK_SIZE = int(os.environ.get('ID_BLOCK_SIZE', 1000))
+_id_blocks = {} # collection_name -> [next_id, end_id (exclusive)]
+
+def _seed_counter(collection_name):
+    """Makes sure the counter starts after ids that existed before the counters collection."""
+    last_doc = db[collection_name].find_one(sort=[('id', -1)], projection={'id': 1})
+    last_id = last_doc['id'] if last_doc and 'id' in last_doc else 0
+    db.counters.update_one({'_id': collection_name}, {'$max': {'seq': last_id}}, upsert=True)
+
+def allocate_ids(collection_name, count=1):
+    """Returns a list of `count` new unique ids for a collection."""
+    with entity_lock('sequence', collection_name):
+        block = _id_blocks.get(collection_name)
+        if block is None:
+            _seed_counter(collection_name)
+            block = _id_blocks[collection_name] = [0, 0]
+        
+        ids = []
+        while len(ids) < count:
+            if block[0] >= block[1]:
+                # Reserve a new block (large enough for the whole request) in one round-trip
+                size = max(ID_BLOCK_SIZE, count - len(ids))
+                counter = db.counters.find_one_and_update(
+                    {'_id': collection_name},
+                    {'$inc': {'seq': size}},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+                block[1] = counter['seq'] + 1
+                block[0] = block[1] - size
+            
+            take = min(count - len(ids), block[1] - block[0])
+            ids.extend(range(block[0], block[0] + take))
+            block[0] += take
+        return ids
+
 # Helper function to get next ID (since MongoDB doesn't have auto-increment)
 def get_next_sequence_value(collection_name):
     """Gets the next sequential ID for a collection."""
-    with db_lock:
-        try:
-            # Find the next sequential ID.
-            last_doc = db[collection_name].find_one(sort=[('id', -1)])
-            return (last_doc['id'] if last_doc and 'id' in last_doc else 0) + 1
-        except Exception as e:
-            logging.error(f"Error getting next sequence value for {collection_name}: {e}")
-            return 1
+    return allocate_ids(collection_name)[0]
 
 def add_wallet(crypto_name, address):
     """Adds or updates a wallet address."""
-    with db_lock:
-        try:
-            db.wallets.update_one(
-                {'crypto_name': crypto_name},
-                {'$set': {'wallet_address': address, 'updated_at': datetime.now()}},
-                upsert=True
-            )
-        except OperationFailure as e:
-            logging.error(f"MongoDB error in add_wallet: {e}")
+    try:
+        db.wallets.update_one(
+            {'crypto_name': crypto_name},
+            {'$set': {'wallet_address': address, 'updated_at': datetime.now()}},
+            upsert=True
+        )
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in add_wallet: {e}")
 
 def get_wallets():
     """Retrieves all stored wallets."""
-    with db_lock:
-        try:
-            wallets = db.wallets.find({})
-            return {wallet['crypto_name']: wallet['wallet_address'] for wallet in wallets}
-        except OperationFailure as e:
-            logging.error(f"MongoDB error in get_wallets: {e}")
-            return {}
+    try:
+        wallets = db.wallets.find({})
+        return {wallet['crypto_name']: wallet['wallet_address'] for wallet in wallets}
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in get_wallets: {e}")
+        return {}
 
 def get_product_by_id(product_id):
     """Retrieves an active product by ID."""
-    with db_lock:
-        try:
-            # Convert product_id to integer if it's a string
-            p_id = int(product_id) if isinstance(product_id, str) and product_id.isdigit() else product_id
-            
-            product = db.products.find_one({'id': p_id, 'status': 'active'})
-            if product:
-                return {
-                    'id': product['id'], 
-                    'name': product['product_name'], 
-                    'price': Decimal(str(product['price'])), 
-                    'type': product['product_type'], 
-                    'has_stock': product.get('has_stock', 0)
-                }
-            return None
-        except OperationFailure as e:
-            logging.error(f"MongoDB error in get_product_by_id: {e}")
-            return None
-        except ValueError:
-            logging.error(f"Invalid product_id: {product_id}")
-            return None
+    try:
+        # Convert product_id to integer if it's a string
+        p_id = int(product_id) if isinstance(product_id, str) and product_id.isdigit() else product_id
+        
+        product = db.products.find_one({'id': p_id, 'status': 'active'})
+        if product:
+            return {
+                'id': product['id'], 
+                'name': product['product_name'], 
+                'price': Decimal(str(product['price'])), 
+                'type': product['product_type'], 
+                'has_stock': product.get('has_stock', 0),
+                'stock': product.get('available_count', 0)
+            }
+        return None
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in get_product_by_id: {e}")
+        return None
+    except ValueError:
+        logging.error(f"Invalid product_id: {product_id}")
+        return None
 
 def update_product_stock_status(product_id, has_stock):
     """Updates the has_stock status for a product."""
-    with db_lock:
-        try:
-            db.products.update_one(
-                {'id': product_id},
-                {'$set': {'has_stock': has_stock}}
-            )
-        except OperationFailure as e:
-            logging.error(f"MongoDB error in update_product_stock_status: {e}")
+    try:
+        db.products.update_one(
+            {'id': product_id},
+            {'$set': {'has_stock': has_stock}}
+        )
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in update_product_stock_status: {e}")
+
+def adjust_available_count(product_id, delta, session=None):
+    """Atomically adds delta to a product's available_count and keeps has_stock in sync."""
+    try:
+        # A pipeline update is applied atomically to the single product document,
+        # so has_stock can never disagree with the counter it is derived from.
+        db.products.update_one(
+            {'id': product_id},
+            [
+                {'$set': {'available_count': {'$add': [{'$ifNull': ['$available_count', 0]}, delta]}}},
+                {'$set': {'has_stock': {'$cond': [{'$gt': ['$available_count', 0]}, 1, 0]}}}
+            ],
+            session=session
+        )
+    except OperationFailure as e:
+        if session is not None:
+            # Let the transaction abort instead of committing the stash change alone
+            raise
+        logging.error(f"MongoDB error in adjust_available_count: {e}")
+
+STOCK_RECONCILE_INTERVAL = float(os.environ.get('STOCK_RECONCILE_INTERVAL', 600)) # Seconds between counter repairs on servers without transactions
+
+def reconcile_stock_counters():
+    """Rebuilds available_count/has_stock of every product from the stash and returns how many were corrected."""
+    try:
+        # Products are read before the stash so that any counter moved in between fails the guard below
+        products = list(db.products.find({}, {'id': 1, 'available_count': 1, 'has_stock': 1}))
+        counts = {
+            doc['_id']: doc['count']
+            for doc in db.product_stash.aggregate([
+                {'$match': {'is_used': 0}},
+                {'$group': {'_id': '$product_id', 'count': {'$sum': 1}}}
+            ])
+        }
+        
+        updates = []
+        for product in products:
+            count = counts.get(product['id'], 0)
+            has_stock = 1 if count > 0 else 0
+            if product.get('available_count') != count or product.get('has_stock') != has_stock:
+                # Skipped if a sale or upload moved the counter since it was read; the next run fixes it
+                updates.append(UpdateOne(
+                    {'id': product['id'], 'available_count': product.get('available_count')},
+                    {'$set': {'available_count': count, 'has_stock': has_stock}}
+                ))
+        
+        if updates:
+            db.products.bulk_write(updates, ordered=False)
+        return len(updates)
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in reconcile_stock_counters: {e}")
+        return 0
+
+def reconcile_stock_counters_loop(interval=STOCK_RECONCILE_INTERVAL):
+    """Periodically repairs stock counters that drifted (a crash between the stash write and the counter update on a standalone server)."""
+    while True:
+        time.sleep(interval)
+        corrected = reconcile_stock_counters()
+        if corrected:
+            logging.warning(f"Reconciled drifted stock counters for {corrected} products.")
 
 def add_product(name, price, product_type, has_stock):
     """Adds a new product."""
-    with db_lock:
-        try:
-            new_id = get_next_sequence_value('products')
-            
-            product_doc = {
-                'id': new_id,
-                'product_name': name,
-                'price': float(price), # Store as float/double in MongoDB
-                'product_type': product_type,
-                'status': 'active',
-                'has_stock': has_stock,
-                'created_at': datetime.now()
-            }
-            db.products.insert_one(product_doc)
-            return new_id
-        except OperationFailure as e:
-            if 'duplicate key error' in str(e):
-                logging.warning(f"Attempted to add duplicate product name: {name}")
-            else:
-                logging.error(f"Error adding product: {e}")
-            return None
+    try:
+        new_id = get_next_sequence_value('products')
+        
+        product_doc = {
+            'id': new_id,
+            'product_name': name,
+            'price': float(price), # Store as float/double in MongoDB
+            'product_type': product_type,
+            'status': 'active',
+            'has_stock': has_stock,
+            'available_count': 0,
+            'created_at': datetime.now()
+        }
+        db.products.insert_one(product_doc)
+        return new_id
+    except OperationFailure as e:
+        if 'duplicate key error' in str(e):
+            logging.warning(f"Attempted to add duplicate product name: {name}")
+        else:
+            logging.error(f"Error adding product: {e}")
+        return None
 
 def delete_product(product_id):
     """Deletes a product by setting its status to 'deleted'."""
-    with db_lock:
-        try:
-            db.products.update_one(
-                {'id': product_id},
-                {'$set': {'status': 'deleted'}}
-            )
-        except OperationFailure as e:
-            logging.error(f"MongoDB error in delete_product: {e}")
+    try:
+        db.products.update_one(
+            {'id': product_id},
+            {'$set': {'status': 'deleted'}}
+        )
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in delete_product: {e}")
 
 def get_products():
     """Retrieves all active products with stock count."""
-    with db_lock:
-        try:
-            products_cursor = db.products.find({'status': 'active'})
-            products = {}
-            for product in products_cursor:
-                pid = product['id']
-                stock_count = get_stock_count(pid)
-                
-                has_stock = 1 if stock_count > 0 else 0
-                
-                products[str(pid)] = {
-                    'name': product['product_name'], 
-                    'price': Decimal(str(product['price'])), 
-                    'type': product['product_type'], 
-                    'has_stock': has_stock, 
-                    'stock': stock_count
-                }
-            return products
-        except OperationFailure as e:
-            logging.error(f"MongoDB error in get_products: {e}")
-            return {}
+    try:
+        # available_count is maintained on every stash change, so the whole
+        # catalogue is a single find() with no per-product stash queries.
+        products_cursor = db.products.find(
+            {'status': 'active'},
+            {'_id': 0, 'id': 1, 'product_name': 1, 'price': 1, 'product_type': 1, 'available_count': 1}
+        )
+        products = {}
+        for product in products_cursor:
+            pid = product['id']
+            stock_count = product.get('available_count', 0)
+            
+            has_stock = 1 if stock_count > 0 else 0
+            
+            products[str(pid)] = {
+                'name': product['product_name'], 
+                'price': Decimal(str(product['price'])), 
+                'type': product['product_type'], 
+                'has_stock': has_stock, 
+                'stock': stock_count
+            }
+        return products
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in get_products: {e}")
+        return {}
 
 def get_stock_count(product_id):
-    """Gets the count of unused items in the stash for a product."""
-    with db_lock:
-        try:
-            count = db.product_stash.count_documents({'product_id': product_id, 'is_used': 0})
-            return count
-        except OperationFailure as e:
-            logging.error(f"MongoDB error in get_stock_count: {e}")
-            return 0
+    """Gets the count of unused items in the stash for a product from its maintained counter."""
+    try:
+        product = db.products.find_one({'id': product_id}, {'available_count': 1})
+        return product.get('available_count', 0) if product else 0
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in get_stock_count: {e}")
+        return 0
 
 def add_stash_item(product_id, content, file_id=None, file_type=None):
-    """Adds an item to the product stash and updates product stock status."""
-    with db_lock:
-        try:
-            new_id = get_next_sequence_value('product_stash')
-            
-            stash_doc = {
-                'id': new_id,
-                'product_id': product_id,
-                'content': content,
-                'file_id': file_id,
-                'file_type': file_type,
-                'is_used': 0,
-                'added_at': datetime.now()
-            }
-            db.product_stash.insert_one(stash_doc)
-            
-            update_product_stock_status(product_id, 1)
-            return new_id
-        except OperationFailure as e:
-            logging.error(f"MongoDB error in add_stash_item: {e}")
-            return None
+    """Adds an item to the product stash and increments the product's available_count."""
+    try:
+        new_id = get_next_sequence_value('product_stash')
+        
+        stash_doc = {
+            'id': new_id,
+            'product_id': product_id,
+            'content': content,
+            'file_id': file_id,
+            'file_type': file_type,
+            'is_used': 0,
+            'added_at': datetime.now()
+        }
+        def insert(session):
+            db.product_stash.insert_one(stash_doc, session=session)
+            adjust_available_count(product_id, 1, session=session)
+        
+        run_in_transaction(insert)
+        return new_id
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in add_stash_item: {e}")
+        return None
 
 def get_available_stash_item(product_id):
     """Gets one available stash item without marking it as used."""
-    with db_lock:
-        try:
-            item = db.product_stash.find_one({'product_id': product_id, 'is_used': 0}, sort=[('added_at', 1)])
+    try:
+        item = db.product_stash.find_one({'product_id': product_id, 'is_used': 0}, sort=[('added_at', 1), ('id', 1)])
+        if item:
+            return {'id': item['id'], 'content': item['content'], 'file_id': item['file_id'], 'file_type': item['file_type']}
+        return None
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in get_available_stash_item: {e}")
+        return None
+
+def reserve_stash_item(product_id, txid):
+    """Atomically reserves the oldest unused stash item of a product for a TXID and returns it (or None)."""
+    try:
+        # Picking and flipping the item is a single server-side operation, so two
+        # buyers (even on different bot replicas) can never get the same item.
+        # The stock counter is decremented in the same transaction.
+        def reserve(session):
+            item = db.product_stash.find_one_and_update(
+                {'product_id': product_id, 'is_used': 0},
+                {'$set': {'is_used': 1, 'reserved_by': txid, 'reserved_at': datetime.now()}},
+                sort=[('added_at', 1), ('id', 1)],
+                return_document=ReturnDocument.AFTER,
+                session=session
+            )
             if item:
-                return {'id': item['id'], 'content': item['content'], 'file_id': item['file_id'], 'file_type': item['file_type']}
-            return None
-        except OperationFailure as e:
-            logging.error(f"MongoDB error in get_available_stash_item: {e}")
-            return None
+                adjust_available_count(product_id, -1, session=session)
+            return item
+        
+        item = run_in_transaction(reserve)
+        if item:
+            return {'id': item['id'], 'content': item['content'], 'file_id': item['file_id'], 'file_type': item['file_type']}
+        return None
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in reserve_stash_item: {e}")
+        return None
 
 def mark_stash_item_used(stash_id):
-    """Marks a stash item as used and checks if stock is depleted."""
-    with db_lock:
-        try:
-            # 1. Mark as used
-            result = db.product_stash.update_one(
-                {'id': stash_id},
-                {'$set': {'is_used': 1}}
+    """Marks a stash item as used and decrements its product's available_count."""
+    try:
+        # Only a real 0 -> 1 transition touches the counter, so repeated calls are harmless
+        def mark(session):
+            item = db.product_stash.find_one_and_update(
+                {'id': stash_id, 'is_used': 0},
+                {'$set': {'is_used': 1}},
+                projection={'product_id': 1},
+                session=session
             )
-            
-            if result.modified_count > 0:
-                # 2. Check stock status
-                item = db.product_stash.find_one({'id': stash_id}, {'product_id': 1})
-                if item and 'product_id' in item:
-                    product_id = item['product_id']
-                    if get_stock_count(product_id) == 0:
-                        update_product_stock_status(product_id, 0)
-        except OperationFailure as e:
-            logging.error(f"MongoDB error in mark_stash_item_used: {e}")
+            if item and 'product_id' in item:
+                adjust_available_count(item['product_id'], -1, session=session)
+        
+        run_in_transaction(mark)
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in mark_stash_item_used: {e}")
 
 def unmark_stash_item_used(stash_id):
-    """Unmarks a stash item (returns it to stock) and updates product stock status."""
-    with db_lock:
-        try:
-            # 1. Unmark as used
-            result = db.product_stash.update_one(
-                {'id': stash_id},
-                {'$set': {'is_used': 0}}
+    """Unmarks a stash item (returns it to stock) and increments its product's available_count."""
+    try:
+        # Only a real 1 -> 0 transition touches the counter, so repeated calls are harmless
+        def unmark(session):
+            item = db.product_stash.find_one_and_update(
+                {'id': stash_id, 'is_used': 1},
+                {'$set': {'is_used': 0}, '$unset': {'reserved_by': '', 'reserved_at': ''}},
+                projection={'product_id': 1},
+                session=session
             )
-            
-            if result.modified_count > 0:
-                # 2. Check stock status
-                item = db.product_stash.find_one({'id': stash_id}, {'product_id': 1})
-                if item and 'product_id' in item:
-                    product_id = item['product_id']
-                    update_product_stock_status(product_id, 1)
-        except OperationFailure as e:
-            logging.error(f"MongoDB error in unmark_stash_item_used: {e}")
+            if item and 'product_id' in item:
+                adjust_available_count(item['product_id'], 1, session=session)
+        
+        run_in_transaction(unmark)
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in unmark_stash_item_used: {e}")
 
 def add_transaction(user_id, username, product_id, product_name, amount, crypto, txid, status, stash_id):
     """Adds a new transaction record."""
-    with db_lock:
-        try:
-            transaction_doc = {
-                'user_id': user_id,
-                'username': username,
-                'product_id': product_id,
-                'product_name': product_name,
-                'amount': float(amount),
-                'crypto_type': crypto,
-                'txid': txid,
-                'status': status,
-                'stash_id': stash_id,
-                'created_at': datetime.now()
-            }
-            db.transactions.insert_one(transaction_doc)
-            return True
-        except OperationFailure as e:
-            if 'duplicate key error' in str(e):
-                logging.warning(f"Attempted to add duplicate transaction ID: {txid}")
-                return False
-            else:
-                logging.error(f"Error adding transaction: {e}")
-                return False
+    try:
+        transaction_doc = {
+            'user_id': user_id,
+            'username': username,
+            'product_id': product_id,
+            'product_name': product_name,
+            'amount': float(amount),
+            'crypto_type': crypto,
+            'txid': txid,
+            'status': status,
+            'stash_id': stash_id,
+            'created_at': datetime.now()
+        }
+        db.transactions.insert_one(transaction_doc)
+        return True
+    except OperationFailure as e:
+        if 'duplicate key error' in str(e):
+            logging.warning(f"Attempted to add duplicate transaction ID: {txid}")
+            return False
+        else:
+            logging.error(f"Error adding transaction: {e}")
+            return False
 
 def get_transaction_by_txid(txid):
     """Retrieves a transaction record by its TXID."""
-    with db_lock:
-        try:
-            return db.transactions.find_one({'txid': txid})
-        except OperationFailure as e:
-            logging.error(f"MongoDB error in get_transaction_by_txid: {e}")
-            return None
+    try:
+        return db.transactions.find_one({'txid': txid})
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in get_transaction_by_txid: {e}")
+        return None
 
 def update_transaction_status(txid, status):
     """Updates the status of a transaction."""
-    with db_lock:
-        try:
-            db.transactions.update_one(
-                {'txid': txid},
-                {'$set': {'status': status, 'verified_at': datetime.now()}}
-            )
-        except OperationFailure as e:
-            logging.error(f"MongoDB error in update_transaction_status: {e}")
+    try:
+        db.transactions.update_one(
+            {'txid': txid},
+            {'$set': {'status': status, 'verified_at': datetime.now()}}
+        )
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in update_transaction_status: {e}")
 
 def get_transaction_by_stash_id(stash_id):
     """Retrieves a transaction record by its stash ID."""
-    with db_lock:
-        try:
-            return db.transactions.find_one({'stash_id': stash_id})
-        except OperationFailure as e:
-            logging.error(f"MongoDB error in get_transaction_by_stash_id: {e}")
-            return None
+    try:
+        return db.transactions.find_one({'stash_id': stash_id})
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in get_transaction_by_stash_id: {e}")
+        return None
 
 def get_pending_transactions():
-    """Retrieves all pending transactions."""
-    with db_lock:
-        try:
-            return list(db.transactions.find({'status': 'pending'}))
-        except OperationFailure as e:
-            logging.error(f"MongoDB error in get_pending_transactions: {e}")
-            return []
+    """Streams all pending transactions without loading them all into memory."""
+    try:
+        yield from db.transactions.find({'status': 'pending'})
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in get_pending_transactions: {e}")
 
 def add_user(user_id, username, first_name, last_name):
     """Adds a new user if they don't exist."""
-    with db_lock:
-        try:
-            user_doc = {
-                'id': user_id,
-                'username': username,
-                'first_name': first_name,
-                'last_name': last_name,
-                'joined_at': datetime.now(),
-                'total_purchases': 0,
-                'total_spent': 0.0
-            }
-            db.users.update_one(
-                {'id': user_id},
-                {'$setOnInsert': user_doc},
-                upsert=True
-            )
-        except OperationFailure as e:
-            logging.error(f"MongoDB error in add_user: {e}")
+    try:
+        user_doc = {
+            'id': user_id,
+            'username': username,
+            'first_name': first_name,
+            'last_name': last_name,
+            'joined_at': datetime.now(),
+            'total_purchases': 0,
+            'total_spent': 0.0
+        }
+        db.users.update_one(
+            {'id': user_id},
+            {'$setOnInsert': user_doc},
+            upsert=True
+        )
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in add_user: {e}")
 
 def get_user_stats(user_id):
     """Retrieves user's purchase statistics."""
-    with db_lock:
-        try:
-            user = db.users.find_one({'id': user_id})
-            if user:
-                return {
-                    'joined_at': user['joined_at'], 
-                    'total_purchases': user['total_purchases'], 
-                    'total_spent': user['total_spent']
-                }
-            return None
-        except OperationFailure as e:
-            logging.error(f"MongoDB error in get_user_stats: {e}")
-            return None
+    try:
+        user = db.users.find_one({'id': user_id})
+        if user:
+            return {
+                'joined_at': user['joined_at'], 
+                'total_purchases': user['total_purchases'], 
+                'total_spent': user['total_spent']
+            }
+        return None
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in get_user_stats: {e}")
+        return None
 
 def update_user_stats(user_id, purchase_amount):
     """Updates user's purchase count and total spent."""
-    with db_lock:
-        try:
-            db.users.update_one(
-                {'id': user_id},
-                {
-                    '$inc': {'total_purchases': 1, 'total_spent': float(purchase_amount)}
-                }
-            )
-        except OperationFailure as e:
-            logging.error(f"MongoDB error in update_user_stats: {e}")
+    try:
+        db.users.update_one(
+            {'id': user_id},
+            {
+                '$inc': {'total_purchases': 1, 'total_spent': float(purchase_amount)}
+            }
+        )
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in update_user_stats: {e}")
 
 def is_txid_used(txid):
     """Checks if a transaction ID has already been processed."""
-    with db_lock:
-        try:
-            return db.used_txids.find_one({'txid': txid}) is not None
-        except OperationFailure as e:
-            logging.error(f"MongoDB error in is_txid_used: {e}")
-            return False
+    try:
+        return db.used_txids.find_one({'txid': txid}) is not None
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in is_txid_used: {e}")
+        return False
 
 def mark_txid_used(txid):
     """Marks a transaction ID as used."""
-    with db_lock:
-        try:
-            db.used_txids.insert_one({'txid': txid, 'used_at': datetime.now()})
-        except OperationFailure as e:
-            logging.error(f"MongoDB error in mark_txid_used: {e}")
+    try:
+        db.used_txids.insert_one({'txid': txid, 'used_at': datetime.now()})
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in mark_txid_used: {e}")
 
 def get_all_users():
     """Retrieves all users."""
-    with db_lock:
-        try:
-            return list(db.users.find({}))
-        except OperationFailure as e:
-            logging.error(f"MongoDB error in get_all_users: {e}")
-            return []
+    try:
+        return list(db.users.find({}))
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in get_all_users: {e}")
+        return []
 
 def get_all_products_admin():
     """Retrieves all products for admin view."""
-    with db_lock:
-        try:
-            return list(db.products.find({}))
-        except OperationFailure as e:
-            logging.error(f"MongoDB error in get_all_products_admin: {e}")
-            return []
+    try:
+        return list(db.products.find({}))
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in get_all_products_admin: {e}")
+        return []
 
 def get_all_transactions_admin():
     """Retrieves all transactions for admin view."""
-    with db_lock:
-        try:
-            return list(db.transactions.find({}).sort('created_at', -1))
-        except OperationFailure as e:
-            logging.error(f"MongoDB error in get_all_transactions_admin: {e}")
-            return []
+    try:
+        return list(db.transactions.find({}).sort('created_at', -1))
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in get_all_transactions_admin: {e}")
+        return []
 
 # --- End of MongoDB Database Functions ---
 
+# --- Pending Transactions Recovery Sweeper ---
+
+SWEEP_INTERVAL = float(os.environ.get('SWEEP_INTERVAL', 300)) # Seconds between sweeps
+# A payment still pending this many seconds after it was submitted is reported
+PENDING_TIMEOUT = float(os.environ.get('PENDING_TIMEOUT', 3600))
+
+def count_stale_pending_transactions():
+    """Counts pending transactions older than PENDING_TIMEOUT (served by the (status, created_at) index)."""
+    expired_before = datetime.now() - timedelta(seconds=PENDING_TIMEOUT)
+    return db.transactions.count_documents({'status': 'pending', 'created_at': {'$lt': expired_before}})
+
+def background_check_pending_transactions():
+    """Background loop that reports payments left pending (e.g. by a crash) within one sweep interval."""
+    # This runtime has no blockchain explorer, so it cannot tell an unpaid order from a
+    # paid one that was never confirmed. Expiring them (and returning their stash items to
+    # stock) is left to bot_mongo's sweeper, which verifies each one on-chain first.
+    while True:
+        try:
+            stale = count_stale_pending_transactions()
+            if stale:
+                logging.warning(f"{stale} transactions have been pending for more than {PENDING_TIMEOUT:.0f}s and need review.")
+        except Exception as e:
+            logging.error(f"Error in pending transactions sweep: {e}")
+        time.sleep(SWEEP_INTERVAL)
+
 # ... (باقي كود البوت كما هو)
 # ... (هنا يأتي باقي كود البوت الذي لم يتغير)
 # ...
 
+# --- Webhook Ingestion ---
+
+UPDATE_MODE = os.environ.get('UPDATE_MODE', 'polling') # 'polling' or 'webhook'
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL', os.environ.get('RENDER_EXTERNAL_URL', '')) # Public base URL of this service
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '') # Echoed by Telegram in X-Telegram-Bot-Api-Secret-Token; required in webhook mode and shared by every replica
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', 8))
+WEBHOOK_QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', 1000))
+
+webhook_queue = queue.Queue(maxsize=WEBHOOK_QUEUE_SIZE)
+
+def enqueue_update(body):
+    """Queues a raw update for the webhook workers and returns False when the queue is full."""
+    try:
+        webhook_queue.put_nowait(body)
+        return True
+    except queue.Full:
+        # Telegram retries updates answered with an error, so nothing is lost
+        logging.warning("Webhook queue is full, asking Telegram to retry later.")
+        return False
+
+def webhook_worker():
+    """Parses queued updates and runs their handlers."""
+    while True:
+        body = webhook_queue.get()
+        try:
+            bot.process_new_updates([types.Update.de_json(body.decode('utf-8'))])
+        except Exception as e:
+            logging.error(f"Error processing webhook update: {e}")
+        finally:
+            webhook_queue.task_done()
+
+def start_webhook():
+    """Registers the webhook and starts its workers; returns False if Telegram refused it."""
+    try:
+        bot.set_webhook(url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+                        max_connections=min(WEBHOOK_WORKERS * 5, 100))
+        logging.info(f"Webhook registered at {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}.")
+    except Exception as e:
+        logging.error(f"Failed to register webhook: {e}")
+        return False
+    
+    # The workers are the bounded pool, so handlers run on them instead of telebot's own pool
+    bot.threaded = False
+    for _ in range(WEBHOOK_WORKERS):
+        threading.Thread(target=webhook_worker, daemon=True).start()
+    return True
+
+def start_bot_polling():
+    """Starts the bot polling loop (removing any webhook first, since Telegram refuses polling while one is set)."""
+    bot.remove_webhook()
+    bot.infinity_polling()
+
 # --- Main Loop ---
 
 if __name__ == '__main__':
+    # Every replica (and every restart) must verify updates with the secret Telegram was given
+    if UPDATE_MODE == 'webhook' and not WEBHOOK_SECRET:
+        logging.error("WEBHOOK_SECRET must be set when UPDATE_MODE is 'webhook'.")
+        raise RuntimeError("WEBHOOK_SECRET is required in webhook mode")
+    
     # Initialize the database connection globally
     db = init_database()
     
+    # Backfill stock counters for products created before available_count existed
+    if db.products.find_one({'available_count': {'$exists': False}}):
+        logging.info(f"Reconciled stock counters for {reconcile_stock_counters()} products.")
+    
+    # Without transactions the stash write and the counter update can be split by a crash
+    if not transactions_supported():
+        threading.Thread(target=reconcile_stock_counters_loop, daemon=True).start()
+    
     # --- Dummy Web Server for Render/Heroku Compatibility ---
     app = Flask(__name__)
     
     @app.route('/', methods=['GET', 'HEAD'])
     def index():
-        return 'Bot is running (Polling mode, Dummy Server Active)', 200
+        return f'Bot is running ({UPDATE_MODE.capitalize()} mode, Dummy Server Active)', 200
+    
+    @app.route(WEBHOOK_PATH, methods=['POST'])
+    def webhook():
+        if UPDATE_MODE != 'webhook':
+            return '', 404
+        if not hmac.compare_digest(request.headers.get('X-Telegram-Bot-Api-Secret-Token', ''), WEBHOOK_SECRET):
+            return '', 403
+        # Answer right away; the update is handled by the webhook workers
+        return ('', 200) if enqueue_update(request.get_data()) else ('', 503)
 
     # Run the Flask server in a separate thread
     def run_flask():
@@ -497,9 +800,15 @@ if __name__ == '__main__':
     logging.info("Starting background thread for pending transactions...")
     threading.Thread(target=background_check_pending_transactions, daemon=True).start()
     
-    logging.info("Starting Telegram Bot Polling in a separate thread...")
-    polling_thread = threading.Thread(target=bot.infinity_polling, daemon=True)
-    polling_thread.start()
+    # Receive updates through the web server below, or fall back to polling
+    if UPDATE_MODE == 'webhook' and not (WEBHOOK_URL and start_webhook()):
+        logging.warning("Webhook mode is not available (set WEBHOOK_URL), falling back to polling.")
+        UPDATE_MODE = 'polling'
+    
+    if UPDATE_MODE == 'polling':
+        logging.info("Starting Telegram Bot Polling in a separate thread...")
+        polling_thread = threading.Thread(target=start_bot_polling, daemon=True)
+        polling_thread.start()
     
     # Start the dummy server in the main thread
     run_flask()
@@ -0,0 +1,666 @@
+import asyncio
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+
+import aiohttp
+import telebot
+from telebot import types
+from telebot.async_telebot import AsyncTeleBot
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure, PyMongoError
+
+# The shop itself (configuration, keyboards, conversation state, payment
+# verification workers and the admin handlers) lives in bot_mongo. This module
+# is an asyncio runtime for it: the user-facing hot path (browsing, checkout,
+# TXID submission, account) is served by AsyncTeleBot on Motor and aiohttp, so
+# a slow Atlas or price API call only suspends that one conversation. Every
+# other update is handed to the threaded handlers of bot_mongo.
+import bot_mongo as shop
+
+# --- Configuration and Setup ---
+
+ASYNC_MONGO_POOL_SIZE = int(os.environ.get('ASYNC_MONGO_POOL_SIZE', 100))
+
+abot = AsyncTeleBot(shop.BOT_TOKEN)
+adb = AsyncIOMotorClient(shop.MONGO_URI, maxPoolSize=ASYNC_MONGO_POOL_SIZE)[shop.DB_NAME]
+
+http_session = None # aiohttp.ClientSession, created inside the event loop by main()
+
+# Conversation state is shared with the threaded handlers (admin flows, fallbacks)
+user_sessions = shop.user_sessions
+user_state = shop.user_state
+
+async def session_io(func, *args):
+    """Runs a session store read (get, pop, membership) off the loop when the store may load it from MongoDB."""
+    # Writes only touch memory (the mongo backend flushes them from its own thread)
+    if isinstance(user_state, shop.MongoSessionStore):
+        return await asyncio.to_thread(func, *args)
+    return func(*args)
+
+async def is_awaiting_txid(message):
+    """Message filter: the sender is at the TXID step of a checkout."""
+    state = await session_io(user_state.get, message.from_user.id)
+    return state is not None and state['step'] == 'awaiting_txid'
+
+# --- Database Functions (Motor) ---
+# Async ports of the bot_mongo functions used on the user-facing path. They
+# issue the same queries, so they are covered by the same index manifest.
+
+async def get_catalogue(name):
+    """Returns a collection from bot_mongo's catalogue cache, loading it off the loop when needed."""
+    data = shop.catalogue_cache.peek(name)
+    if data is None:
+        data = await asyncio.to_thread(shop.catalogue_cache.get, name)
+    return data
+
+async def get_wallets():
+    """Retrieves all stored wallets."""
+    try:
+        wallets = (await get_catalogue('wallets')).values()
+        return {wallet['crypto_name']: wallet['wallet_address'] for wallet in wallets if wallet.get('wallet_address')}
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in get_wallets: {e}")
+        return {}
+
+async def get_wallet_xpub(crypto_name):
+    """Retrieves the stored extended public key of a wallet (or None)."""
+    try:
+        wallet = (await get_catalogue('wallets')).get(crypto_name)
+        return wallet.get('xpub') if wallet else None
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in get_wallet_xpub: {e}")
+        return None
+
+async def next_counter_value(name):
+    """Returns the next value of a gap-free counter."""
+    counter = await adb.counters.find_one_and_update(
+        {'_id': name},
+        {'$inc': {'seq': 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return counter['seq']
+
+async def allocate_id(collection_name):
+    """Returns a new unique id for a collection from bot_mongo's shared id blocks."""
+    # Served from memory almost always; the rare block refill is a blocking call, so keep it off the loop
+    return (await asyncio.to_thread(shop.allocate_ids, collection_name))[0]
+
+async def get_product_by_id(product_id):
+    """Retrieves an active product by ID (from the catalogue cache; stock is read with get_stock_count)."""
+    try:
+        product = (await get_catalogue('products')).get(product_id)
+        if product and product.get('status') == 'active':
+            return {
+                'id': product['id'],
+                'name': product['product_name'],
+                'price': Decimal(str(product['price'])),
+                'type': product['product_type']
+            }
+        return None
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in get_product_by_id: {e}")
+        return None
+
+async def get_stock_count(product_id):
+    """Gets the count of unused items in the stash for a product from its maintained counter."""
+    try:
+        product = await adb.products.find_one({'id': product_id}, {'available_count': 1})
+        return product.get('available_count', 0) if product else 0
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in get_stock_count: {e}")
+        return 0
+
+async def get_products():
+    """Retrieves all active products with stock count."""
+    try:
+        products = {}
+        async for product in adb.products.find(
+            {'status': 'active'},
+            {'_id': 0, 'id': 1, 'product_name': 1, 'price': 1, 'product_type': 1, 'available_count': 1}
+        ):
+            stock_count = product.get('available_count', 0)
+            products[str(product['id'])] = {
+                'name': product['product_name'],
+                'price': Decimal(str(product['price'])),
+                'type': product['product_type'],
+                'has_stock': 1 if stock_count > 0 else 0,
+                'stock': stock_count
+            }
+        return products
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in get_products: {e}")
+        return {}
+
+async def run_in_transaction(operation):
+    """Runs await operation(session) as one multi-document transaction (see bot_mongo.run_in_transaction)."""
+    # Cached by start_background_workers at startup, so this does not block the loop
+    if not shop.transactions_supported():
+        return await operation(None)
+    async with await adb.client.start_session() as session:
+        return await session.with_transaction(operation)
+
+async def adjust_available_count(product_id, delta, session=None):
+    """Atomically adds delta to a product's available_count and keeps has_stock in sync."""
+    try:
+        await adb.products.update_one(
+            {'id': product_id},
+            [
+                {'$set': {'available_count': {'$add': [{'$ifNull': ['$available_count', 0]}, delta]}}},
+                {'$set': {'has_stock': {'$cond': [{'$gt': ['$available_count', 0]}, 1, 0]}}}
+            ],
+            session=session
+        )
+    except OperationFailure as e:
+        if session is not None:
+            # Let the transaction abort instead of committing the stash change alone
+            raise
+        logging.error(f"MongoDB error in adjust_available_count: {e}")
+
+async def reserve_stash_item(product_id, txid):
+    """Atomically reserves the oldest unused stash item of a product for a TXID and returns it (or None)."""
+    async def reserve(session):
+        item = await adb.product_stash.find_one_and_update(
+            {'product_id': product_id, 'is_used': 0},
+            {'$set': {'is_used': 1, 'reserved_by': txid, 'reserved_at': datetime.now()}},
+            sort=[('added_at', 1), ('id', 1)],
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        if item:
+            await adjust_available_count(product_id, -1, session=session)
+        return item
+    
+    try:
+        item = await run_in_transaction(reserve)
+        if item:
+            return {'id': item['id'], 'content': item['content'], 'file_id': item['file_id'], 'file_type': item['file_type']}
+        return None
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in reserve_stash_item: {e}")
+        return None
+
+async def unmark_stash_item_used(stash_id):
+    """Unmarks a stash item (returns it to stock) and increments its product's available_count."""
+    async def unmark(session):
+        item = await adb.product_stash.find_one_and_update(
+            {'id': stash_id, 'is_used': 1},
+            {'$set': {'is_used': 0}, '$unset': {'reserved_by': '', 'reserved_at': ''}},
+            projection={'product_id': 1},
+            session=session
+        )
+        if item and 'product_id' in item:
+            await adjust_available_count(item['product_id'], 1, session=session)
+    
+    try:
+        await run_in_transaction(unmark)
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in unmark_stash_item_used: {e}")
+
+async def record_stats(inc, totals_inc=None):
+    """Applies one stats increment (see bot_mongo.record_stats) in a single round-trip."""
+    try:
+        await adb.stats.bulk_write(shop.stats_updates(inc, totals_inc), ordered=False)
+    except PyMongoError as e:
+        logging.error(f"MongoDB error in record_stats: {e}")
+
+async def add_transaction(user_id, username, product_id, product_name, amount, crypto, txid, status, stash_id, ltc_address=None):
+    """Adds a new transaction record."""
+    try:
+        await adb.transactions.insert_one({
+            'id': await allocate_id('transactions'),
+            'user_id': user_id,
+            'username': username,
+            'product_id': product_id,
+            'product_name': product_name,
+            'amount': float(amount),
+            'crypto_type': crypto,
+            'txid': txid,
+            'status': status,
+            'stash_id': stash_id,
+            'ltc_address': ltc_address,
+            'check_attempts': 0,
+            'created_at': datetime.now()
+        })
+        await record_stats(*shop.order_stats(status))
+        return True
+    except OperationFailure as e:
+        if 'duplicate key error' in str(e):
+            logging.warning(f"Attempted to add duplicate transaction ID: {txid}")
+        else:
+            logging.error(f"Error adding transaction: {e}")
+        return False
+
+async def create_deposit_order(user_id, username, product_id, product_name, amount, crypto, deposit_address, deposit_index):
+    """Adds an order paid to its own deposit address and returns its id (or None)."""
+    try:
+        new_id = await allocate_id('transactions')
+        now = datetime.now()
+        await adb.transactions.insert_one({
+            'id': new_id,
+            'user_id': user_id,
+            'username': username,
+            'product_id': product_id,
+            'product_name': product_name,
+            'amount': float(amount),
+            'crypto_type': crypto,
+            'status': 'awaiting_payment',
+            'stash_id': None,
+            'deposit_address': deposit_address,
+            'deposit_index': deposit_index,
+            'created_at': now,
+            'expires_at': now + timedelta(seconds=shop.DEPOSIT_ORDER_TTL)
+        })
+        await record_stats(*shop.order_stats('awaiting_payment'))
+        return new_id
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in create_deposit_order: {e}")
+        return None
+
+async def cancel_deposit_order(order_id):
+    """Cancels a deposit order unless a payment to its address was already seen."""
+    try:
+        result = await adb.transactions.update_one(
+            {'id': order_id, 'status': 'awaiting_payment', 'paid_txid': {'$exists': False}},
+            {'$set': {'status': 'cancelled'}}
+        )
+        if result.modified_count:
+            await record_stats(*shop.status_change_stats('awaiting_payment', 'cancelled'))
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in cancel_deposit_order: {e}")
+
+async def is_txid_known(txid):
+    """Checks if a TXID was already submitted for a transaction or already processed."""
+    try:
+        transaction, used = await asyncio.gather(
+            adb.transactions.find_one({'txid': txid}, {'_id': 1}),
+            adb.used_txids.find_one({'txid': txid}, {'_id': 1})
+        )
+        return transaction is not None or used is not None
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in is_txid_known: {e}")
+        return False
+
+async def schedule_transaction_check(txid, next_check_at, attempts):
+    """Persists the verification schedule of a pending transaction so it survives restarts."""
+    try:
+        await adb.transactions.update_one(
+            {'txid': txid, 'status': 'pending'},
+            {'$set': {'next_check_at': next_check_at, 'check_attempts': attempts}}
+        )
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in schedule_transaction_check: {e}")
+
+async def get_user(user_id):
+    """Retrieves a user's record."""
+    try:
+        user = await adb.users.find_one({'id': user_id})
+        if user:
+            # Order of fields: id, username, first_name, last_name, joined_at, total_purchases, total_spent
+            return [
+                user.get('id'),
+                user.get('username'),
+                user.get('first_name'),
+                user.get('last_name'),
+                user.get('joined_at'),
+                user.get('total_purchases'),
+                user.get('total_spent')
+            ]
+        return None
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in get_user: {e}")
+        return None
+
+async def add_or_update_user(user_id, username, first_name, last_name):
+    """Adds a new user or updates existing user details."""
+    try:
+        result = await adb.users.update_one(
+            {'id': user_id},
+            {
+                '$set': {
+                    'username': username,
+                    'first_name': first_name,
+                    'last_name': last_name,
+                },
+                # A user who writes to the bot again is reachable by broadcasts
+                '$unset': {'blocked': ''},
+                '$setOnInsert': {
+                    'joined_at': datetime.now(),
+                    'total_purchases': 0,
+                    'total_spent': 0.0
+                }
+            },
+            upsert=True
+        )
+        if result.upserted_id is not None:
+            await record_stats({'users': 1})
+    except OperationFailure as e:
+        logging.error(f"MongoDB error in add_or_update_user: {e}")
+
+# --- LTC Price (aiohttp) ---
+
+async def fetch_ltc_price():
+    """Asks each price source in turn and returns the first valid price (or None)."""
+    for name, url, parse in shop.LTC_PRICE_SOURCES:
+        try:
+            async with http_session.get(url) as response:
+                response.raise_for_status()
+                price = Decimal(str(parse(await response.json(content_type=None))))
+            if price > 0:
+                return price
+            logging.warning(f"LTC price source {name} returned a non-positive price: {price}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.warning(f"Error fetching LTC price from {name}: {e}")
+        except (KeyError, IndexError, TypeError, ValueError, StopIteration, InvalidOperation) as e:
+            logging.warning(f"Error processing LTC price data from {name}: {e}")
+    logging.error("All LTC price sources failed.")
+    return None
+
+async def get_ltc_price():
+    """Returns the cached LTC price, fetching it without blocking the loop when nothing usable is cached."""
+    price = shop.ltc_price_oracle.peek()
+    if price is not None:
+        return price
+    price = await fetch_ltc_price()
+    if price is not None:
+        shop.ltc_price_oracle.store(price)
+    return price
+
+async def price_refresh_loop(interval=shop.PRICE_CACHE_TTL / 2):
+    """Keeps the shared price cache warm (the async replacement for PriceOracle.start)."""
+    while True:
+        price = await fetch_ltc_price()
+        if price is not None:
+            shop.ltc_price_oracle.store(price)
+        await asyncio.sleep(interval)
+
+# --- QR Codes ---
+
+async def send_qr_photo(chat_id, data, **kwargs):
+    """Sends the QR code of `data` as a photo, reusing bot_mongo's rendered images and file_ids."""
+    file_id = shop.get_qr_file_id(data)
+    if file_id:
+        try:
+            return await abot.send_photo(chat_id, file_id, **kwargs)
+        except telebot.asyncio_helper.ApiTelegramException as e:
+            logging.warning(f"Cached QR file_id rejected, uploading again: {e}")
+    image = await asyncio.to_thread(shop.generate_qr_code, data)
+    sent_message = await abot.send_photo(chat_id, image, **kwargs)
+    shop.remember_qr_file_id(data, sent_message)
+    return sent_message
+
+# --- Screen Edits ---
+
+async def edit_message_if_changed(message, text, reply_markup=None, parse_mode=None):
+    """Edits a message into a screen unless it already shows it (see bot_mongo.edit_message_if_changed)."""
+    reply_markup_json = shop.markup_to_json(reply_markup)
+    digest = shop.screen_digest(text, reply_markup_json, parse_mode)
+    if shop.is_screen_shown(message, digest, reply_markup_json):
+        return False
+    try:
+        await abot.edit_message_text(text=text, chat_id=message.chat.id, message_id=message.message_id,
+                                     reply_markup=reply_markup_json, parse_mode=parse_mode)
+    except telebot.asyncio_helper.ApiTelegramException as e:
+        if "message is not modified" not in str(e):
+            raise
+    shop.remember_screen(message, digest)
+    return True
+
+# --- Bot Handlers (User Facing) ---
+
+@abot.message_handler(commands=['start', 'help'])
+async def send_welcome(message):
+    """Handles the /start and /help commands."""
+    user_id = message.from_user.id
+    first_name = message.from_user.first_name
+
+    await add_or_update_user(user_id, message.from_user.username, first_name, message.from_user.last_name)
+
+    text = f"👋 أهلاً بك يا {first_name}!\n\nاستخدم الزر أدناه لتصفح المنتجات المتاحة."
+
+    await abot.send_message(user_id, text, reply_markup=shop.get_main_menu_markup())
+
+@abot.callback_query_handler(func=lambda call: call.data == 'main_menu')
+async def main_menu_callback(call):
+    """Handles the 'main_menu' callback."""
+    text = "👋 أهلاً بك!\n\nاستخدم الزر أدناه لتصفح المنتجات المتاحة."
+    await edit_message_if_changed(call.message, text, reply_markup=shop.get_main_menu_markup())
+
+@abot.callback_query_handler(func=lambda call: call.data == 'show_products')
+async def show_products_callback(call):
+    """Displays the list of available products."""
+    products = await get_products()
+
+    text = "🛒 **المنتجات المتاحة**\n\nاختر المنتج الذي ترغب في شرائه:"
+
+    try:
+        await edit_message_if_changed(call.message, text, reply_markup=shop.get_products_markup(products), parse_mode='Markdown')
+    except telebot.asyncio_helper.ApiTelegramException as e:
+        if "message is not modified" not in str(e):
+            logging.error(f"Error editing show_products message: {e}")
+
+@abot.callback_query_handler(func=lambda call: call.data.startswith('buy_product_'))
+async def buy_product_callback(call):
+    """Handles the product selection and initiates the purchase process."""
+    user_id = call.from_user.id
+    product_id = int(call.data.split('_')[2])
+
+    product = await get_product_by_id(product_id)
+
+    if not product:
+        await abot.answer_callback_query(call.id, "❌ هذا المنتج غير متوفر حالياً.", show_alert=True)
+        return
+
+    if await get_stock_count(product_id) == 0:
+        await abot.answer_callback_query(call.id, "❌ عذراً، لقد نفد مخزون هذا المنتج.", show_alert=True)
+        return
+
+    session = {'product_id': product_id}
+
+    wallets, xpub = await asyncio.gather(
+        get_wallets(),
+        get_wallet_xpub('LTC') if shop.PAYMENT_MODE == 'address' else asyncio.sleep(0)
+    )
+    if not wallets.get('LTC') and not xpub:
+        await abot.answer_callback_query(call.id, "❌ خطأ: لم يتم تعيين محفظة LTC في الإعدادات.", show_alert=True)
+        return
+
+    ltc_address = wallets.get('LTC')
+
+    ltc_price_usd = await get_ltc_price()
+    if not ltc_price_usd:
+        await abot.answer_callback_query(call.id, "❌ فشل في الحصول على سعر LTC. يرجى المحاولة لاحقاً.", show_alert=True)
+        return
+
+    required_amount_ltc = product['price'] / ltc_price_usd
+
+    if xpub:
+        deposit_index = await next_counter_value('deposit_index_LTC')
+        ltc_address = await asyncio.to_thread(shop.derive_deposit_address, xpub, deposit_index)
+        order_id = await create_deposit_order(user_id, call.from_user.username, product_id, product['name'],
+                                              required_amount_ltc, 'LTC', ltc_address, deposit_index)
+        if not order_id:
+            await abot.answer_callback_query(call.id, "❌ حدث خطأ أثناء إنشاء الطلب. يرجى المحاولة لاحقاً.", show_alert=True)
+            return
+        session['order_id'] = order_id
+
+    session['required_amount_ltc'] = required_amount_ltc
+    session['ltc_address'] = ltc_address
+    user_sessions[user_id] = session
+    await record_stats({'checkouts': 1})
+
+    payment_uri = f"litecoin:{ltc_address}?amount={required_amount_ltc:.8f}"
+
+    text = (
+        f"🧾 **تأكيد الطلب: {product['name']}**\n\n"
+        f"💰 **السعر:** {product['price']:.2f} USD\n"
+        f"🪙 **المبلغ المطلوب (LTC):** `{required_amount_ltc:.8f}`\n\n"
+        f"**لإتمام الدفع، أرسل المبلغ المحدد إلى العنوان التالي:**\n"
+        f"`{ltc_address}`\n\n"
+        f"⚠️ **تنبيه:** أرسل المبلغ المحدد بالضبط. أي مبلغ خاطئ قد يؤدي إلى تأخير أو فشل في تأكيد الدفع.\n\n"
+    )
+    if xpub:
+        text += "هذا العنوان مخصص لطلبك فقط. سيتم إرسال المنتج تلقائياً فور تأكيد الدفع، لا حاجة لإرسال معرف المعاملة."
+    else:
+        text += "بعد إرسال المبلغ، يرجى نسخ **معرف المعاملة (TXID)** وإرساله هنا."
+
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("❌ إلغاء الطلب", callback_data='cancel_order'))
+
+    try:
+        await send_qr_photo(call.message.chat.id, payment_uri, caption=text,
+                            reply_markup=markup, parse_mode='Markdown')
+        await abot.answer_callback_query(call.id, "✅ تم إنشاء طلبك. يرجى إتمام الدفع.")
+
+        if not xpub:
+            user_state[user_id] = {'step': 'awaiting_txid'}
+
+        try:
+            await abot.delete_message(call.message.chat.id, call.message.message_id)
+        except Exception:
+            pass
+
+    except Exception as e:
+        logging.error(f"Error sending buy product message: {e}")
+        await abot.answer_callback_query(call.id, "❌ حدث خطأ أثناء إنشاء الطلب. يرجى المحاولة لاحقاً.", show_alert=True)
+
+@abot.callback_query_handler(func=lambda call: call.data == 'cancel_order')
+async def cancel_order_callback(call):
+    """Handles the 'cancel_order' callback."""
+    user_id = call.from_user.id
+    session = await session_io(user_sessions.pop, user_id, None)
+    if session and 'order_id' in session:
+        await cancel_deposit_order(session['order_id'])
+    await session_io(user_state.pop, user_id, None)
+
+    await abot.answer_callback_query(call.id, "❌ تم إلغاء الطلب بنجاح.", show_alert=True)
+
+    text = "👋 أهلاً بك!\n\nتم إلغاء طلبك. يمكنك تصفح المنتجات مرة أخرى."
+
+    try:
+        await edit_message_if_changed(call.message, text, reply_markup=shop.get_main_menu_markup())
+    except telebot.asyncio_helper.ApiTelegramException as e:
+        if "message is not modified" not in str(e):
+            logging.error(f"Error editing cancel order message: {e}")
+
+@abot.message_handler(func=is_awaiting_txid)
+async def handle_txid_input(message):
+    """Handles the user's input of the transaction ID (TXID)."""
+    user_id = message.from_user.id
+    txid = (message.text or '').strip()
+
+    if not txid:
+        await abot.reply_to(message, "❌ يرجى إرسال معرف المعاملة (TXID) بشكل صحيح.")
+        return
+
+    session_data = await session_io(user_sessions.get, user_id)
+    if not session_data:
+        await abot.reply_to(message, "❌ انتهت صلاحية طلبك. يرجى بدء عملية الشراء من جديد.")
+        await session_io(user_state.pop, user_id, None)
+        return
+
+    product_id = session_data['product_id']
+    required_amount_ltc = session_data['required_amount_ltc']
+
+    if await is_txid_known(txid):
+        await abot.reply_to(message, "❌ هذا المعرف (TXID) تم استخدامه مسبقاً في عملية أخرى.")
+        return
+
+    product = await get_product_by_id(product_id)
+    product_name = product['name'] if product else str(product_id)
+
+    stash_item = await reserve_stash_item(product_id, txid)
+    if not stash_item:
+        await abot.reply_to(message, "❌ عذراً، لقد نفد مخزون هذا المنتج قبل تأكيد الدفع. سيتم معالجة طلبك يدوياً أو استرداد المبلغ.")
+        await add_transaction(user_id, message.from_user.username, product_id, product_name,
+                              required_amount_ltc, 'LTC', txid, 'stock_error', None)
+        await session_io(user_sessions.pop, user_id, None)
+        await session_io(user_state.pop, user_id, None)
+        return
+
+    if not await add_transaction(user_id, message.from_user.username, product_id, product_name,
+                                 required_amount_ltc, 'LTC', txid, 'pending', stash_item['id'],
+                                 ltc_address=session_data['ltc_address']):
+        await unmark_stash_item_used(stash_item['id'])
+        await abot.reply_to(message, "❌ حدث خطأ أثناء تسجيل المعاملة. يرجى المحاولة لاحقاً.")
+        return
+
+    await session_io(user_sessions.pop, user_id, None)
+    await session_io(user_state.pop, user_id, None)
+
+    await abot.reply_to(message, "⏳ **تم تسجيل معرف المعاملة بنجاح!**\n\nجارٍ التحقق من الدفع على شبكة البلوكشين. قد يستغرق هذا بضع دقائق. سنرسل لك المنتج فور تأكيد المعاملة.")
+
+    # Verification runs on bot_mongo's worker pool, off the update path
+    first_check_at = datetime.now() + timedelta(seconds=shop.VERIFY_FIRST_DELAY)
+    await schedule_transaction_check(txid, first_check_at, 0)
+    shop.verification_scheduler.schedule(txid, first_check_at.timestamp())
+
+@abot.callback_query_handler(func=lambda call: call.data == 'user_account')
+async def user_account_callback(call):
+    """Displays the user's account statistics."""
+    user_data = await get_user(call.from_user.id)
+
+    if not user_data:
+        await abot.answer_callback_query(call.id, "❌ لم يتم العثور على بيانات حسابك. يرجى استخدام /start أولاً.", show_alert=True)
+        return
+
+    total_purchases = user_data[5]
+    total_spent = user_data[6]
+    joined_at = user_data[4].strftime("%Y-%m-%d") if user_data[4] else "N/A"
+
+    text = "👤 **حسابي**\n\n"
+    text += f"🗓️ تاريخ الانضمام: **{joined_at}**\n"
+    text += f"🛒 إجمالي المشتريات: **{total_purchases}**\n"
+    text += f"💵 إجمالي المبالغ المصروفة (USD): **{total_spent:.2f}**\n"
+
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("◀️ رجوع", callback_data='main_menu'))
+
+    await edit_message_if_changed(call.message, text, reply_markup=markup, parse_mode='Markdown')
+
+# --- Fallback to the Threaded Handlers ---
+# Registered last, so they only see updates none of the async handlers above
+# matched (admin panel, admin input steps, stock uploads). The threaded bot
+# runs the matching handler on its own worker pool, so the loop is not blocked.
+
+@abot.message_handler(func=lambda message: True, content_types=['text', 'document', 'photo'])
+async def delegate_message(message):
+    """Passes a message to the threaded handlers of bot_mongo."""
+    # Its step router reads user_state while filtering, before the handler reaches the worker pool
+    await session_io(shop.bot.process_new_messages, [message])
+
+@abot.callback_query_handler(func=lambda call: True)
+async def delegate_callback_query(call):
+    """Passes a callback query to the threaded handlers of bot_mongo."""
+    shop.bot.process_new_callback_query([call])
+
+# --- Polling Loop ---
+
+async def main():
+    """Runs the bot on asyncio (the alternative to bot_mongo's threaded start_bot_polling)."""
+    global http_session
+    http_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=shop.PRICE_HTTP_TIMEOUT))
+
+    # The price cache is refreshed by the loop below instead of a thread
+    shop.start_background_workers(refresh_price=False)
+    price_task = asyncio.create_task(price_refresh_loop())
+
+    logging.info("Starting async bot polling...")
+    try:
+        await abot.infinity_polling()
+    finally:
+        price_task.cancel()
+        await http_session.close()
+        await abot.close_session()
+
+if __name__ == '__main__':
+    PORT = int(os.environ.get('PORT', 8080))
+
+    # Keep Render happy with the same dummy HTTP server as the threaded runtime
+    threading.Thread(target=shop.run_dummy_server, args=(PORT,), daemon=True).start()
+
+    asyncio.run(main())
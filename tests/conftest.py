@@ -0,0 +1,20 @@
+import pytest
+
+from tests.mongo_stub import load_legacy_bot, load_shop, reset
+
+bot_mongo = load_shop()
+bot = load_legacy_bot()
+
+
+@pytest.fixture
+def shop():
+    """The bot_mongo module with empty collections."""
+    reset(bot_mongo)
+    return bot_mongo
+
+
+@pytest.fixture
+def legacy_bot():
+    """The bot.py module with empty collections."""
+    reset(bot)
+    return bot
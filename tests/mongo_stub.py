@@ -0,0 +1,129 @@
+"""Loads bot_mongo against an in-memory MongoDB (mongomock) for tests and benchmarks."""
+import collections
+import functools
+import inspect
+import os
+import sys
+import threading
+import time
+from unittest import mock
+
+import mongomock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Like the server, every single-document operation is atomic; mongomock on its
+# own does not guarantee that across threads.
+_server_lock = threading.RLock()
+# Seconds each operation waits before reaching the "server" (a network round-trip)
+ROUND_TRIP = {'seconds': 0.0}
+# Operations that reached the server, by method name
+ROUND_TRIPS = collections.Counter()
+# (method name, session) of the operations that ran inside a client session
+SESSION_OPERATIONS = []
+WRITE_METHODS = ('insert_one', 'insert_many', 'update_one', 'update_many', 'replace_one', 'delete_one',
+                 'delete_many', 'find_one_and_update', 'find_one_and_replace', 'find_one_and_delete', 'bulk_write')
+READ_METHODS = ('find', 'find_one', 'count_documents', 'aggregate')
+
+
+_inside_server = threading.local()
+
+
+def _with_round_trip(method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        # mongomock has no sessions; record which operations ran in one and run them directly
+        session = kwargs.pop('session', None)
+        if session is not None:
+            SESSION_OPERATIONS.append((method.__name__, session))
+        # mongomock implements some operations with others; only the outer call is a round-trip
+        if getattr(_inside_server, 'active', False):
+            return method(*args, **kwargs)
+        ROUND_TRIPS[method.__name__] += 1
+        if ROUND_TRIP['seconds']:
+            time.sleep(ROUND_TRIP['seconds'])
+        with _server_lock:
+            _inside_server.active = True
+            try:
+                return method(*args, **kwargs)
+            finally:
+                _inside_server.active = False
+    return wrapper
+
+
+def _drop_unknown_kwargs(method):
+    # Newer pymongo passes options (e.g. sort) that mongomock's bulk builder does not know
+    known = set(inspect.signature(method).parameters)
+    
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        return method(*args, **{key: value for key, value in kwargs.items() if key in known})
+    return wrapper
+
+
+def explain_with_indexes(cursor):
+    """Stands in for Cursor.explain(): a minimal planner that picks an index whose
+    first key is filtered or sorted on, and otherwise reports a COLLSCAN."""
+    fields = set(cursor._spec or {})
+    sort_keys = [key for key, _ in (cursor._sort or [])]
+    for name, index in cursor.collection.index_information().items():
+        first_key = index['key'][0][0]
+        if first_key in fields or sort_keys[:1] == [first_key]:
+            return {'queryPlanner': {'winningPlan': {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN', 'indexName': name}}}}
+    return {'queryPlanner': {'winningPlan': {'stage': 'COLLSCAN'}}}
+
+
+def _standalone_hello(command):
+    """Answers the 'hello' handshake (not implemented by mongomock) like a standalone server, which has no transactions."""
+    @functools.wraps(command)
+    def wrapper(self, command_name, *args, **kwargs):
+        if command_name == 'hello':
+            return {'isWritablePrimary': True, 'ok': 1.0}
+        return command(self, command_name, *args, **kwargs)
+    return wrapper
+
+
+def load_shop():
+    """Imports bot_mongo connected to mongomock and returns the module."""
+    if 'bot_mongo' in sys.modules:
+        return sys.modules['bot_mongo']
+    
+    # bot_mongo connects at import time
+    os.environ['MONGO_URI'] = 'mongodb://localhost'
+    os.environ.setdefault('BOT_TOKEN', '123456:TEST')
+    sys.path.insert(0, ROOT)
+    
+    for name in WRITE_METHODS + READ_METHODS:
+        setattr(mongomock.collection.Collection, name, _with_round_trip(getattr(mongomock.collection.Collection, name)))
+    for name in ('add_update', 'add_replace', 'add_delete'):
+        builder = mongomock.collection.BulkOperationBuilder
+        setattr(builder, name, _drop_unknown_kwargs(getattr(builder, name)))
+    mongomock.collection.Cursor.explain = explain_with_indexes
+    mongomock.database.Database.command = _standalone_hello(mongomock.database.Database.command)
+    
+    with mock.patch('pymongo.MongoClient', mongomock.MongoClient):
+        import bot_mongo
+    return bot_mongo
+
+
+def load_legacy_bot():
+    """Imports bot.py (the original single-file bot) against the same mongomock server and returns the module."""
+    load_shop() # Installs the mongomock patches
+    if 'bot' in sys.modules:
+        return sys.modules['bot']
+    
+    # bot.py only connects in __main__
+    import bot
+    bot.mongo_client = mongomock.MongoClient()
+    bot.db = bot.mongo_client[bot.DB_NAME]
+    bot.ensure_indexes(bot.db)
+    return bot
+
+
+def reset(shop):
+    """Empties every collection (indexes are kept) and the module's in-process caches."""
+    for name in shop.db.list_collection_names():
+        shop.db[name].delete_many({})
+    shop._id_blocks.clear()
+    if hasattr(shop, 'catalogue_cache'):
+        shop.catalogue_cache._data.clear()
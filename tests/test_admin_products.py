@@ -0,0 +1,57 @@
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+
+def admin_call(shop, data):
+    message = SimpleNamespace(chat=SimpleNamespace(id=shop.ADMIN_ID), message_id=1, from_user=None)
+    return SimpleNamespace(id='1', data=data, from_user=SimpleNamespace(id=shop.ADMIN_ID), message=message)
+
+
+def buttons(markup):
+    return [button.callback_data for row in markup.keyboard for button in row]
+
+
+@pytest.fixture
+def product_id(shop):
+    product_id = shop.add_product('Netflix', 5.0, 'text', 0)
+    shop.add_stash_items(product_id, ['a', 'b'])
+    return product_id
+
+
+def test_product_buttons_open_the_management_screen(shop, product_id):
+    call = admin_call(shop, f'manage_product_{product_id}')
+    assert shop.router.route_callback(call.data) is shop.manage_product_callback
+    
+    with mock.patch.object(shop, 'edit_message_if_changed') as edit:
+        shop.manage_product_callback(call)
+    
+    text, markup = edit.call_args.args[1], edit.call_args.kwargs['reply_markup']
+    assert 'Netflix' in text and '**2**' in text
+    assert buttons(markup) == [f'add_stock_{product_id}', f'atx:p:{product_id}:n:',
+                               f'delete_product_{product_id}', 'admin_products']
+
+
+def test_product_is_deleted_after_confirmation(shop, product_id):
+    with mock.patch.object(shop, 'edit_message_if_changed'), mock.patch.object(shop, 'bot'):
+        shop.router.route_callback(f'delete_product_{product_id}')(admin_call(shop, f'delete_product_{product_id}'))
+        assert shop.get_product_by_id(product_id) is not None
+        
+        call = admin_call(shop, f'confirm_delete_product_{product_id}')
+        shop.router.route_callback(call.data)(call)
+    
+    assert shop.get_product_by_id(product_id) is None
+
+
+def test_stock_upload_sends_the_management_screen_as_a_new_message(shop, product_id):
+    admin = SimpleNamespace(id=shop.ADMIN_ID, is_bot=False)
+    message = SimpleNamespace(chat=SimpleNamespace(id=shop.ADMIN_ID), from_user=admin, content_type='text', text='c\nd')
+    shop.user_state[shop.ADMIN_ID] = {'step': 'awaiting_stock_content', 'product_id': product_id}
+    
+    with mock.patch.object(shop, 'edit_message_if_changed') as edit, mock.patch.object(shop, 'bot') as bot:
+        shop.handle_stock_content_input(message)
+    
+    edit.assert_not_called()
+    text = bot.send_message.call_args.args[1]
+    assert 'Netflix' in text and '**4**' in text
@@ -0,0 +1,84 @@
+import threading
+import time
+
+
+class FakeSender:
+    """Answers every queued send at once, except the first `drops[user_id]` sends to a user, which are lost."""
+    
+    def __init__(self, drops=None):
+        self.drops = dict(drops or {})
+        self.sends = []
+        self.lock = threading.Lock()
+    
+    def submit(self, chat_id, method, *args, on_success=None, on_failure=None, **kwargs):
+        job = {'state': 'done'}
+        with self.lock:
+            self.sends.append((chat_id, method))
+            if self.drops.get(chat_id):
+                self.drops[chat_id] -= 1
+                return job
+        if on_success:
+            on_success(True)
+        return job
+    
+    def is_pending(self, job):
+        return False
+    
+    def cancel(self, job):
+        return False
+
+
+class SlowBot:
+    """Takes `delay` seconds per copy_message, longer than the broadcast waits between checks."""
+    
+    def __init__(self, delay):
+        self.delay = delay
+        self.copies = []
+    
+    def copy_message(self, chat_id, from_chat_id, message_id):
+        time.sleep(self.delay)
+        self.copies.append(chat_id)
+
+
+def start_broadcast(shop, users):
+    shop.db.users.insert_many([{'id': user_id} for user_id in range(1, users + 1)])
+    shop.db.broadcasts.insert_one({'id': 1, 'from_chat_id': 99, 'message_id': 5, 'status': 'running',
+                                   'last_user_id': None, 'sent': 0, 'failed': 0, 'blocked': 0})
+
+
+def test_lost_sends_are_retried_after_the_batch_timeout(shop, monkeypatch):
+    monkeypatch.setattr(shop, 'BROADCAST_BATCH_TIMEOUT', 0.05)
+    start_broadcast(shop, 6)
+    sender = FakeSender(drops={3: 1, 5: 1})
+    
+    shop.Broadcaster(sender, batch_size=6).run(1)
+    
+    broadcast = shop.db.broadcasts.find_one({'id': 1})
+    assert (broadcast['status'], broadcast['sent'], broadcast['failed'], broadcast['last_user_id']) == ('done', 6, 0, 6)
+    copies = [chat_id for chat_id, method in sender.sends if method == 'copy_message']
+    assert sorted(copies) == [1, 2, 3, 3, 4, 5, 5, 6]
+
+
+def test_sends_never_confirmed_count_as_failed(shop, monkeypatch):
+    monkeypatch.setattr(shop, 'BROADCAST_BATCH_TIMEOUT', 0.05)
+    monkeypatch.setattr(shop, 'BROADCAST_BATCH_ATTEMPTS', 2)
+    start_broadcast(shop, 4)
+    
+    shop.Broadcaster(FakeSender(drops={2: 10}), batch_size=4).run(1)
+    
+    broadcast = shop.db.broadcasts.find_one({'id': 1})
+    assert (broadcast['status'], broadcast['sent'], broadcast['failed'], broadcast['last_user_id']) == ('done', 3, 1, 4)
+
+
+def test_slow_sends_are_waited_for_not_sent_twice(shop, monkeypatch):
+    monkeypatch.setattr(shop, 'BROADCAST_BATCH_TIMEOUT', 0.02)
+    start_broadcast(shop, 6)
+    slow_bot = SlowBot(delay=0.03)
+    send_queue = shop.SendQueue(slow_bot, workers=1)
+    send_queue.start()
+    
+    shop.Broadcaster(send_queue, batch_size=6).run(1)
+    
+    broadcast = shop.db.broadcasts.find_one({'id': 1})
+    assert (broadcast['status'], broadcast['sent'], broadcast['failed']) == ('done', 6, 0)
+    assert sorted(slow_bot.copies) == [1, 2, 3, 4, 5, 6]
@@ -0,0 +1,37 @@
+from tests import mongo_stub
+
+
+def test_catalogue_is_one_round_trip_with_live_stock(shop):
+    for i in range(20):
+        shop.add_product(f'product-{i}', 1.5, 'text', 0)
+    first_id = shop.db.products.find_one({'product_name': 'product-0'})['id']
+    shop.add_stash_items(first_id, ['a', 'b', 'c'])
+    shop.reserve_stash_item(first_id, 'txid')
+    
+    mongo_stub.ROUND_TRIPS.clear()
+    products = shop.get_products()
+    
+    assert sum(mongo_stub.ROUND_TRIPS.values()) == 1
+    assert len(products) == 20
+    assert products[str(first_id)]['stock'] == 2
+    assert products[str(first_id)]['has_stock'] == 1
+    assert sum(product['has_stock'] for product in products.values()) == 1
+
+
+def test_change_filter_keeps_updates_that_touch_cached_fields(shop):
+    def update(coll, updated, removed=()):
+        return {'operationType': 'update', 'ns': {'db': 'bot_db', 'coll': coll},
+                'updateDescription': {'updatedFields': updated, 'removedFields': list(removed)}}
+    
+    events = shop.db.change_events
+    events.insert_many([
+        dict(update('products', {'available_count': 4, 'has_stock': 1}), name='counter only'),
+        dict(update('products', {'available_count': 4, 'price': 2.0}), name='counter and price'),
+        dict(update('products', {'available_count': 4}, removed=['product_name']), name='counter and removed name'),
+        dict(update('wallets', {'wallet_address': 'L2'}), name='wallet address'),
+        dict(update('transactions', {'status': 'verified'}), name='other collection'),
+        {'operationType': 'delete', 'ns': {'db': 'bot_db', 'coll': 'products'}, 'name': 'product delete'},
+    ])
+    
+    matched = {doc['name'] for doc in events.find(shop.catalogue_cache.change_filter())}
+    assert matched == {'counter and price', 'counter and removed name', 'wallet address', 'product delete'}
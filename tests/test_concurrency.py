@@ -0,0 +1,58 @@
+import threading
+import time
+
+from tests import mongo_stub
+
+
+def run_threads(count, target):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def add_product(shop, items):
+    shop.db.products.insert_one({'id': 1, 'product_name': 'p', 'price': 1.0, 'product_type': 'text',
+                                 'status': 'active', 'available_count': 0})
+    shop.add_stash_items(1, [f'item-{i}' for i in range(items)])
+
+
+def test_parallel_buyers_never_get_the_same_stash_item(shop):
+    add_product(shop, 300)
+    reserved = []
+    
+    def buyer():
+        while True:
+            item = shop.reserve_stash_item(1, 'txid')
+            if not item:
+                return
+            reserved.append(item['id'])
+    
+    run_threads(16, buyer)
+    
+    assert len(reserved) == 300
+    assert len(set(reserved)) == 300
+    assert shop.get_stock_count(1) == 0
+
+
+def test_parallel_id_allocation_is_unique(shop):
+    ids = []
+    run_threads(8, lambda: ids.extend(shop.allocate_ids('transactions', 1)[0] for _ in range(500)))
+    assert len(set(ids)) == 4000
+
+
+def test_reads_run_in_parallel(shop, monkeypatch):
+    add_product(shop, 1)
+    monkeypatch.setitem(mongo_stub.ROUND_TRIP, 'seconds', 0.02)
+    
+    def handler():
+        for _ in range(5):
+            shop.get_stock_count(1)
+    
+    started = time.monotonic()
+    run_threads(8, handler)
+    elapsed = time.monotonic() - started
+    
+    # 40 round-trips of 20 ms: ~0.8 s if reads were serialized, ~0.1 s in parallel
+    assert elapsed < 0.4
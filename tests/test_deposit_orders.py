@@ -0,0 +1,47 @@
+from unittest import mock
+
+TXID = 'cd' * 32
+
+
+def add_order(shop, order_id, paid_amount):
+    shop.db.transactions.insert_one({
+        'id': order_id, 'user_id': 7, 'username': 'buyer', 'product_id': 1, 'product_name': 'p',
+        'amount': 0.5, 'crypto_type': 'LTC', 'status': 'awaiting_payment', 'deposit_address': f'addr-{order_id}',
+        'paid_txid': TXID, 'paid_amount': paid_amount, 'paid_height': 100
+    })
+    return shop.db.transactions.find_one({'id': order_id})
+
+
+def add_product(shop, items):
+    shop.db.products.insert_one({'id': 1, 'product_name': 'p', 'price': 1.0, 'product_type': 'text',
+                                 'status': 'active', 'available_count': 0})
+    shop.add_stash_items(1, [f'item-{i}' for i in range(items)])
+
+
+def test_low_amount_order_has_no_stash_item_to_release(shop):
+    add_product(shop, 1)
+    with mock.patch.object(shop, 'unmark_stash_item_used') as unmark:
+        shop.finalize_deposit_order(add_order(shop, 1, 0.1))
+    
+    unmark.assert_not_called()
+    assert shop.db.transactions.find_one({'id': 1})['status'] == 'low_amount'
+
+
+def test_one_payment_to_two_deposit_addresses_flags_the_second_order(shop):
+    add_product(shop, 2)
+    first, second = add_order(shop, 1, 0.5), add_order(shop, 2, 0.5)
+    
+    shop.finalize_deposit_order(first)
+    shop.finalize_deposit_order(second)
+    
+    assert shop.db.transactions.find_one({'id': 1})['status'] == 'verified'
+    flagged = shop.db.transactions.find_one({'id': 2})
+    assert flagged['status'] == 'shared_txid'
+    assert 'txid' not in flagged
+    assert shop.get_stock_count(1) == 1
+
+
+def test_address_mode_needs_a_block_scanning_explorer(shop):
+    assert shop.resolve_payment_mode('address', shop.BlockcypherBackend()) == 'txid'
+    assert shop.resolve_payment_mode('address', shop.BlockchairBackend()) == 'address'
+    assert shop.resolve_payment_mode('txid', shop.FakeExplorerBackend()) == 'txid'
@@ -0,0 +1,37 @@
+import threading
+import time
+
+import telebot
+
+
+def make_update(update_id, chat_id):
+    return telebot.types.Update.de_json({
+        'update_id': update_id,
+        'message': {'message_id': update_id, 'date': 0, 'chat': {'id': chat_id, 'type': 'private'},
+                    'from': {'id': chat_id, 'is_bot': False, 'first_name': 'u'}, 'text': 'x'}
+    })
+
+
+def test_polling_again_while_handlers_are_busy_does_not_refetch(shop):
+    pending = [make_update(update_id, chat_id=update_id % 2) for update_id in range(1, 7)]
+    handled = []
+    lock = threading.Lock()
+    
+    def slow_handle(update):
+        time.sleep(0.05)
+        with lock:
+            handled.append(update.update_id)
+    
+    polling_bot = telebot.TeleBot('1:test', threaded=False)
+    # Like getUpdates: everything after the acknowledged offset is returned again
+    polling_bot.get_updates = lambda offset=None, **kwargs: [u for u in pending if u.update_id >= offset]
+    dispatcher = shop.ChatDispatcher(slow_handle, shards=2)
+    dispatcher.install(polling_bot)
+    
+    for _ in range(3):
+        polling_bot._TeleBot__retrieve_updates()
+    for shard_queue in dispatcher.queues:
+        shard_queue.join()
+    
+    assert sorted(handled) == [1, 2, 3, 4, 5, 6]
+    assert [u for u in handled if u % 2] == [1, 3, 5] # In order within a chat
@@ -0,0 +1,46 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime
+
+
+def add_transactions(shop):
+    for day, status in ((3, 'verified'), (1, 'verified'), (2, 'pending'), (9, 'verified')):
+        shop.db.transactions.insert_one({
+            'id': day, 'created_at': datetime(2024, 1, day), 'verified_at': datetime(2024, 1, day, 1) if status == 'verified' else None,
+            'status': status, 'user_id': 1, 'username': 'buyer', 'product_id': 1, 'product_name': 'p',
+            'amount': 0.5, 'crypto_type': 'LTC', 'txid': f'{day:064x}', 'ltc_address': 'not exported'
+        })
+
+
+def read_export(shop, rows, file_format):
+    buffer = io.BytesIO()
+    count = shop.write_export(rows, file_format, buffer)
+    return count, gzip.decompress(buffer.getvalue()).decode('utf-8')
+
+
+def test_sales_export_is_date_filtered_and_ordered(shop):
+    add_transactions(shop)
+    
+    rows = shop.iter_export_rows('sales', datetime(2024, 1, 1), datetime(2024, 1, 5))
+    count, text = read_export(shop, rows, 'csv')
+    
+    lines = list(csv.reader(io.StringIO(text)))
+    assert count == 2
+    assert lines[0] == list(shop.EXPORT_FIELDS)
+    assert [line[0] for line in lines[1:]] == ['1', '3']
+    assert lines[1][2] == '2024-01-01T01:00:00'
+    assert lines[1][-1] == '' # No deposit address
+
+
+def test_ndjson_export_has_one_document_per_line(shop):
+    add_transactions(shop)
+    
+    count, text = read_export(shop, shop.iter_export_rows('transactions'), 'ndjson')
+    
+    rows = [json.loads(line) for line in text.splitlines()]
+    assert count == 4
+    assert [row['id'] for row in rows] == [1, 2, 3, 9]
+    assert rows[0]['created_at'] == '2024-01-01T00:00:00'
+    assert all('ltc_address' not in row for row in rows)
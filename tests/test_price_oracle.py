@@ -0,0 +1,104 @@
+import json
+import threading
+import time
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class PriceServer(ThreadingHTTPServer):
+    """A local stand-in for the price APIs: each path answers with a configured price, status or delay."""
+    
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), PriceHandler)
+        self.routes = {} # path -> {'price': ..., 'status': ..., 'delay': ...}
+        self.hits = []
+    
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server_port}{path}"
+    
+    def handle_error(self, request, client_address):
+        pass # e.g. a client that timed out before a delayed answer
+
+
+class PriceHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        route = self.server.routes.get(self.path, {'status': 404})
+        self.server.hits.append(self.path)
+        time.sleep(route.get('delay', 0))
+        body = json.dumps({'price': route.get('price')}).encode()
+        self.send_response(route.get('status', 200))
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = PriceServer()
+    threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_oracle(shop, server, **kwargs):
+    sources = [(name, server.url(f'/{name}'), lambda data: data['price']) for name in ('primary', 'secondary')]
+    return shop.PriceOracle(sources, **kwargs)
+
+
+def test_falls_back_to_the_next_source(shop, server):
+    server.routes = {'/primary': {'status': 429}, '/secondary': {'price': '71.5'}}
+    oracle = make_oracle(shop, server)
+    
+    assert oracle.get_price() == Decimal('71.5')
+    assert server.hits == ['/primary', '/secondary']
+
+
+def test_slow_source_times_out(shop, server):
+    server.routes = {'/primary': {'price': 70, 'delay': 1}, '/secondary': {'price': 72}}
+    oracle = make_oracle(shop, server, timeout=0.2)
+    
+    started = time.monotonic()
+    assert oracle.get_price() == Decimal('72')
+    assert time.monotonic() - started < 1
+
+
+def test_fresh_price_is_served_from_cache(shop, server):
+    server.routes = {'/primary': {'price': 70}}
+    oracle = make_oracle(shop, server, ttl=60)
+    
+    assert [oracle.get_price() for _ in range(5)] == [Decimal('70')] * 5
+    assert server.hits == ['/primary']
+
+
+def test_stale_price_is_served_while_revalidating(shop, server):
+    server.routes = {'/primary': {'price': 70}}
+    oracle = make_oracle(shop, server, ttl=0.05, max_stale=60)
+    assert oracle.get_price() == Decimal('70')
+    
+    time.sleep(0.1)
+    server.routes['/primary'] = {'price': 75, 'delay': 0.3}
+    started = time.monotonic()
+    assert oracle.get_price() == Decimal('70')
+    assert time.monotonic() - started < 0.2
+    
+    deadline = time.monotonic() + 2
+    while oracle.peek() != Decimal('75') and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert oracle.peek() == Decimal('75')
+
+
+def test_no_price_once_too_stale_and_sources_are_down(shop, server):
+    server.routes = {'/primary': {'price': 70}}
+    oracle = make_oracle(shop, server, ttl=0.05, max_stale=0.1)
+    assert oracle.get_price() == Decimal('70')
+    
+    server.routes = {'/primary': {'status': 500}, '/secondary': {'status': 503}}
+    time.sleep(0.15)
+    assert oracle.get_price() is None
@@ -0,0 +1,10 @@
+def test_every_data_layer_query_uses_an_index(shop):
+    assert shop.verify_query_plans(shop.db) == []
+
+
+def test_an_unindexed_query_shape_is_reported(shop, monkeypatch):
+    shape = ('transactions', {'ltc_amount': 1}, None)
+    monkeypatch.setattr(shop, 'QUERY_SHAPES', shop.QUERY_SHAPES + [shape])
+    
+    assert shop.verify_query_plans(shop.db) == [shape]
+
@@ -0,0 +1,35 @@
+from types import SimpleNamespace
+
+
+def make_router(shop):
+    router = shop.UpdateRouter()
+    router.callback('buy_product_list')(lambda call: 'exact')
+    router.callback_prefix('buy_')(lambda call: 'short')
+    router.callback_prefix('buy_product_')(lambda call: 'long')
+    router.step('awaiting_txid')(lambda message: 'txid')
+    router.step('awaiting_stock_file', content_types=('document',))(lambda message: 'file')
+    return router
+
+
+def message(user_id, content_type='text'):
+    return SimpleNamespace(from_user=SimpleNamespace(id=user_id), content_type=content_type)
+
+
+def test_callbacks_prefer_exact_data_then_the_longest_prefix(shop):
+    router = make_router(shop)
+    
+    assert router.route_callback('buy_product_list')(None) == 'exact'
+    assert router.route_callback('buy_product_7')(None) == 'long'
+    assert router.route_callback('buy_gift')(None) == 'short'
+    assert router.route_callback('admin_menu') is None
+
+
+def test_messages_are_routed_by_step_and_content_type(shop, monkeypatch):
+    router = make_router(shop)
+    monkeypatch.setitem(shop.user_state, 1, {'step': 'awaiting_txid'})
+    monkeypatch.setitem(shop.user_state, 2, {'step': 'awaiting_stock_file'})
+    
+    assert router.route_message(message(1))(None) == 'txid'
+    assert router.route_message(message(2)) is None
+    assert router.route_message(message(2, 'document'))(None) == 'file'
+    assert router.route_message(message(3)) is None
@@ -0,0 +1,25 @@
+import time
+
+
+def test_paused_chats_outlive_the_chat_cache(shop, monkeypatch):
+    monkeypatch.setattr(shop, 'SEND_CHAT_CACHE_SIZE', 3)
+    queue = shop.SendQueue(telegram_bot=None, chat_rate=1000)
+    now = time.monotonic()
+    queue._chat_ready_at(1, now)
+    queue._retry(1, {'chat_id': 1, 'priority': 0}, 30, pause_chat=True)
+    
+    for chat_id in range(2, 10):
+        assert queue._chat_ready_at(chat_id, now) == now
+    
+    assert len(queue._chats) == 3
+    assert queue._chat_ready_at(1, now) >= now + 29
+
+
+def test_idle_chats_are_evicted_oldest_first(shop, monkeypatch):
+    monkeypatch.setattr(shop, 'SEND_CHAT_CACHE_SIZE', 2)
+    queue = shop.SendQueue(telegram_bot=None, chat_rate=1000)
+    now = time.monotonic()
+    for chat_id in (1, 2, 1, 3):
+        queue._chat_ready_at(chat_id, now)
+    
+    assert list(queue._chats) == [1, 3]
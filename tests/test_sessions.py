@@ -0,0 +1,46 @@
+from decimal import Decimal
+
+import bson
+from bson.codec_options import CodecOptions
+from pymongo.errors import AutoReconnect
+
+
+class FlakyCollection:
+    """A sessions collection that fails the next `failures` writes and encodes documents like the driver."""
+    
+    codec_options = CodecOptions()
+    
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.docs = {}
+    
+    def bulk_write(self, operations, ordered=True):
+        for operation in operations:
+            bson.encode(operation._doc, codec_options=self.codec_options) # Raises InvalidDocument
+        if self.failures:
+            self.failures -= 1
+            raise AutoReconnect('connection reset')
+        for operation in operations:
+            self.docs[operation._filter['_id']] = operation._doc.get('$set', {}).get('data')
+
+
+def test_flush_keeps_sessions_across_a_connection_error(shop):
+    collection = FlakyCollection(failures=1)
+    store = shop.MongoSessionStore('checkout', collection)
+    store[1] = {'product_id': 1}
+    
+    assert store.flush() == 0
+    store[2] = {'product_id': 2}
+    assert store.flush() == 2
+    assert collection.docs == {'checkout:1': {'product_id': 1}, 'checkout:2': {'product_id': 2}}
+
+
+def test_flush_drops_only_sessions_that_cannot_be_encoded(shop):
+    collection = FlakyCollection()
+    store = shop.MongoSessionStore('checkout', collection)
+    store[1] = {'amount': Decimal('0.1')} # No Decimal codec on this collection
+    store[2] = {'product_id': 2}
+    
+    assert store.flush() == 0
+    assert store.flush() == 1
+    assert collection.docs == {'checkout:2': {'product_id': 2}}
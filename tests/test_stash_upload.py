@@ -0,0 +1,22 @@
+def test_duplicates_are_skipped_within_and_across_chunks(shop):
+    shop.db.products.insert_one({'id': 1, 'product_name': 'p', 'price': 1.0, 'product_type': 'text',
+                                 'status': 'active', 'available_count': 0})
+    lines = ['a', 'b', 'a', 'c', '', 'b', 'd', 'a', 'x' * (shop.MAX_STASH_ITEM_LENGTH + 1)]
+    
+    assert shop.add_stash_items(1, lines, chunk_size=2) == (4, 4)
+    assert sorted(doc['content'] for doc in shop.db.product_stash.find()) == ['a', 'b', 'c', 'd']
+    assert shop.get_stock_count(1) == 4
+    
+    assert shop.add_stash_items(1, ['d', 'e']) == (1, 1)
+
+
+def test_items_of_one_upload_are_reserved_in_upload_order(shop):
+    shop.db.products.insert_one({'id': 1, 'product_name': 'p', 'price': 1.0, 'product_type': 'text',
+                                 'status': 'active', 'available_count': 0})
+    shop.add_stash_items(1, ['first', 'second', 'third'])
+    # Every item of the chunk shares added_at; move the first one to the end of the collection's natural order
+    first = shop.db.product_stash.find_one_and_delete({'content': 'first'})
+    shop.db.product_stash.insert_one(first)
+    
+    reserved = [shop.reserve_stash_item(1, f'txid-{i}')['content'] for i in range(3)]
+    assert reserved == ['first', 'second', 'third']
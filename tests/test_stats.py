@@ -0,0 +1,40 @@
+def place_orders(shop):
+    for user_id in (1, 2, 3):
+        shop.add_or_update_user(user_id, f'user{user_id}', 'u', None)
+    for txid in ('a' * 64, 'b' * 64, 'c' * 64):
+        shop.add_transaction(1, 'user1', 7, 'p', 0.5, 'LTC', txid, 'pending', None)
+    shop.update_transaction_status('a' * 64, 'verified', expected_status='pending')
+    shop.record_sale(shop.db.transactions.find_one({'txid': 'a' * 64}))
+    shop.update_transaction_status('b' * 64, 'timeout', expected_status='pending')
+
+
+def summary(totals):
+    return (totals['users'], totals['orders'], totals['sales'], totals['revenue'], totals['status'],
+            totals['products'])
+
+
+def test_rebuild_matches_the_live_rollups(shop):
+    place_orders(shop)
+    live = shop.db.stats.find_one({'_id': 'totals'})
+    
+    shop.rebuild_stats()
+    rebuilt = shop.db.stats.find_one({'_id': 'totals'})
+    
+    assert summary(rebuilt) == summary(live)
+    assert rebuilt['status'] == {'pending': 1, 'verified': 1, 'timeout': 1}
+
+
+def test_rebuild_replaces_documents_in_place_and_drops_stale_buckets(shop, monkeypatch):
+    place_orders(shop)
+    shop.db.stats.insert_one({'_id': 'day:2001-01-01', 'period': 'day', 'orders': 9})
+    shop.db.stats.update_one({'_id': 'totals'}, {'$set': {'status.lost': 4}})
+    deletes = []
+    original_delete_many = type(shop.db.stats).delete_many
+    monkeypatch.setattr(type(shop.db.stats), 'delete_many',
+                        lambda self, query, *args, **kwargs: deletes.append(query) or original_delete_many(self, query, *args, **kwargs))
+    
+    shop.rebuild_stats()
+    
+    assert all(query != {} for query in deletes)
+    assert shop.db.stats.find_one({'_id': 'day:2001-01-01'}) is None
+    assert 'lost' not in shop.db.stats.find_one({'_id': 'totals'})['status']
@@ -0,0 +1,83 @@
+import pytest
+
+from tests import mongo_stub
+
+
+class FakeSession:
+    """A client session whose with_transaction just runs the callback, like a replica set without conflicts."""
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        return False
+    
+    def with_transaction(self, callback):
+        return callback(self)
+
+
+@pytest.fixture(params=['bot_mongo', 'bot'])
+def shop(request, shop, legacy_bot):
+    """Runs every test against both data layers."""
+    return shop if request.param == 'bot_mongo' else legacy_bot
+
+
+def add_product(shop, items):
+    shop.db.products.insert_one({'id': 1, 'product_name': 'p', 'price': 1.0, 'product_type': 'text',
+                                 'status': 'active', 'available_count': 0})
+    for i in range(items):
+        shop.add_stash_item(1, f'item-{i}')
+
+
+def test_counters_follow_reserve_and_release(shop):
+    add_product(shop, 3)
+    
+    item = shop.reserve_stash_item(1, 'txid')
+    shop.mark_stash_item_used(item['id'])
+    assert shop.get_stock_count(1) == 2
+    
+    shop.unmark_stash_item_used(item['id'])
+    shop.unmark_stash_item_used(item['id'])
+    assert shop.get_stock_count(1) == 3
+    assert shop.reconcile_stock_counters() == 0
+
+
+def test_reserve_and_counter_update_share_one_transaction(shop, monkeypatch):
+    add_product(shop, 1)
+    session = FakeSession()
+    monkeypatch.setattr(shop, 'transactions_supported', lambda: True)
+    monkeypatch.setattr(shop.mongo_client, 'start_session', lambda: session)
+    mongo_stub.SESSION_OPERATIONS.clear()
+    
+    assert shop.reserve_stash_item(1, 'txid')
+    
+    assert mongo_stub.SESSION_OPERATIONS == [('find_one_and_update', session), ('update_one', session)]
+    assert shop.get_stock_count(1) == 0
+
+
+def test_reconcile_repairs_a_drifted_counter(shop):
+    add_product(shop, 2)
+    # A crash between the stash flip and the counter update on a standalone server
+    shop.db.product_stash.update_one({'product_id': 1}, {'$set': {'is_used': 1}})
+    
+    assert shop.reconcile_stock_counters() == 1
+    assert shop.get_stock_count(1) == 1
+
+
+def test_reconcile_keeps_a_counter_moved_while_it_ran(shop, monkeypatch):
+    add_product(shop, 2)
+    shop.db.product_stash.update_one({'product_id': 1}, {'$set': {'is_used': 1}})
+    aggregate = shop.db.product_stash.aggregate
+    
+    def aggregate_then_upload(pipeline):
+        counts = list(aggregate(pipeline))
+        shop.add_stash_item(1, 'item-late') # Lands after the stash was counted
+        return counts
+    
+    monkeypatch.setattr(shop.db.product_stash, 'aggregate', aggregate_then_upload)
+    shop.reconcile_stock_counters()
+    assert shop.get_stock_count(1) == 3 # Not overwritten with the stale count of 1
+    
+    monkeypatch.undo()
+    assert shop.reconcile_stock_counters() == 1
+    assert shop.get_stock_count(1) == 2
@@ -0,0 +1,69 @@
+from decimal import Decimal
+
+import pytest
+import requests
+
+from tests.mongo_stub import load_shop
+
+TXID = 'ab' * 32
+ADDRESS = 'ltc1qtest'
+
+
+class FakeExplorer(load_shop().ExplorerBackend):
+    """Answers with fixed explorer data, or fails like an outage when there is none."""
+    
+    name = 'fake'
+    max_batch_size = 50
+    
+    def __init__(self, transactions=None):
+        super().__init__(rate_per_second=1000)
+        self.transactions = transactions
+    
+    def fetch_transactions(self, txids):
+        if self.transactions is None:
+            raise requests.exceptions.ConnectionError('explorer is down')
+        return {txid: self.transactions[txid] for txid in txids if txid in self.transactions}
+
+
+@pytest.fixture
+def pending(shop):
+    shop.db.products.insert_one({'id': 1, 'product_name': 'p', 'price': 1.0, 'product_type': 'text',
+                                 'status': 'active', 'available_count': 0})
+    shop.add_stash_items(1, ['secret'])
+    stash = shop.reserve_stash_item(1, TXID)
+    shop.db.transactions.insert_one({
+        'id': 1, 'txid': TXID, 'user_id': 7, 'username': 'buyer', 'product_id': 1, 'product_name': 'p',
+        'amount': 0.5, 'crypto_type': 'LTC', 'status': 'pending', 'stash_id': stash['id'],
+        'ltc_address': ADDRESS, 'check_attempts': 3
+    })
+    return shop
+
+
+def test_explorer_outage_is_not_counted_as_a_check(pending, monkeypatch):
+    monkeypatch.setitem(pending.explorer_backends, 'LTC', FakeExplorer())
+    monkeypatch.setattr(pending, 'VERIFY_MAX_CHECKS', 4)
+    
+    for _ in range(3):
+        assert pending.verify_pending_transaction(TXID) == pending.VERIFY_BASE_INTERVAL
+    
+    txn = pending.db.transactions.find_one({'txid': TXID})
+    assert (txn['status'], txn['check_attempts']) == ('pending', 3)
+
+
+def test_unconfirmed_payment_is_counted_as_a_check(pending, monkeypatch):
+    tx = {'confirmations': 0, 'outputs': {ADDRESS: Decimal('0.5')}}
+    monkeypatch.setitem(pending.explorer_backends, 'LTC', FakeExplorer({TXID: tx}))
+    monkeypatch.setattr(pending, 'VERIFY_MAX_CHECKS', 4)
+    
+    assert pending.verify_pending_transaction(TXID) is None
+    assert pending.db.transactions.find_one({'txid': TXID})['status'] == 'timeout'
+
+
+def test_used_txid_fails_with_a_machine_status(pending, monkeypatch):
+    monkeypatch.setitem(pending.explorer_backends, 'LTC', FakeExplorer({}))
+    pending.add_used_txid(TXID)
+    
+    assert pending.check_ltc_transaction(TXID, Decimal('0.5'), ADDRESS) == (False, 'used')
+    assert pending.verify_pending_transaction(TXID) is None
+    assert pending.db.transactions.find_one({'txid': TXID})['status'] == 'used'
+    assert pending.get_stock_count(1) == 1